@@ -11,178 +11,241 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied. 
 """
 
-import requests, os, urllib3, json, config_transfer, pandas as pd
+import os, json, time, argparse, config_transfer, template_render, preflight, clusters
+from concurrent.futures import ThreadPoolExecutor
+from jinja2 import TemplateSyntaxError
 from dotenv import load_dotenv
+from dnac_client import DNACClient, TokenBucket
+from resolver_cache import ResolverCache
+from run_journal import RunJournal
+from config_store import ConfigStore
+from mapping import load_mapping, MappingError
+from orchestrator import split_waves, run_waves
+from datetime import datetime
 import delete_old_devices
+import metrics
 
-urllib3.disable_warnings()
 load_dotenv()
 
-dnac = os.environ["DNAC_HOST"]
-username = os.environ["USERNAME"]
-password = os.environ["PASSWORD"]
 project_name = os.environ["DNAC_PROJECT_NAME"]
 onboarding_template = os.environ["DAY0_TEMPLATE"]
-base_url = f"https://{dnac}/dna/intent/api/v1"
+#Maximum number of API calls in flight at once, shared by every stage
+max_workers = int(os.environ.get("DNAC_MAX_WORKERS", 8))
+#Upper limit of API calls per second, lowered automatically while DNAC answers with 429
+api_rate = float(os.environ.get("DNAC_API_RATE", 10))
+#Site claims submitted per second, how often failed claims are retried and the wait before the first retry in
+#seconds (doubled for every further retry)
+claim_rate = float(os.environ.get("CLAIM_RATE", 5))
+claim_retries = 2
+claim_retry_delay = 2
+#How long resolved site and image ids are reused by later runs, in seconds
+resolver_cache_ttl = int(os.environ.get("RESOLVER_CACHE_TTL", 86400))
+#Devices whose rendered day-0 config would be larger than this many bytes are not migrated
+template_max_bytes = int(os.environ.get("TEMPLATE_MAX_BYTES", template_render.max_render_bytes))
 mapping_file = 'config/mapping.csv'
-
-def csv_column_to_list(column_number):
-    df = pd.read_csv(mapping_file)
-    #First column in the mapping file
-    row_value = df.iloc[:, column_number]
-    column_values = row_value.tolist()
-    return column_values  
-
-def auth():
-    headers = {
-              'content-type': "application/json",
-              'x-auth-token': ""
-    }
-    auth_url = f"https://{dnac}/api/system/v1/auth/token"
-    resp = requests.post(url=auth_url, auth=requests.auth.HTTPBasicAuth(username, password), headers=headers, verify=False)
-    return resp.json()["Token"]
-
-
-#Uses the gathered existing serial ids to get information about the existing switches
-def get_devices(token, serials):
-    devices = []
-    headers = {
-              'content-type': "application/json",
-              'x-auth-token': token
-    }
-    for serial in serials: 
-        url = base_url + f"/network-device?serialNumber={serial}"
-        device = requests.get(url=url, headers=headers, verify=False)
-        device = device.json()["response"]
-        devices.extend(device)
-    return devices
-
-#Based on the gather device info we now use the device id's to grab the 
-# existing config and put into a list of configs
-def get_existing_config(token, devices): 
-    all_configs = {}
-    headers = {
-        'content-type': "application/json",
-        'x-auth-token': token
-    }
-
-    for device in devices:
-        device_id = device['id']
-        url = base_url + f"/network-device/{device_id}/config"
-        resp = requests.get(url=url, headers=headers, verify=False)
-        resp = resp.json()["response"]
-        config = config_transfer.template_text_to_list(resp)
-        all_configs.update({device_id:config})
-
-    return all_configs
+#DNA Center clusters and their connection settings, DNAC_HOST alone is a single cluster (see clusters.py)
+profiles = clusters.load_profiles(max_workers, api_rate)
+
+#Creates the pooled client every stage uses and authenticates it, site and image ids are cached per DNAC host.
+#Every cluster gets its own client, so each has its own connection pool and API rate limit
+def auth(profile=None):
+    profile = profile or profiles[0]
+    client = DNACClient(profile.host, profile.username, profile.password, max_workers=profile.max_workers, api_rate=profile.api_rate,
+                        cluster=profile.name)
+    client.resolver = ResolverCache(f".cache/resolver_{profile.cache_name}.json", ttl=resolver_cache_ttl)
+    client.auth()
+    return client
+
+
+#Serials per inventory request and page size of the inventory endpoint (DNAC caps limit at 500)
+inventory_batch_size = 100
+inventory_page_limit = 500
+
+#Uses the gathered existing serial ids to get information about the existing switches.
+#Serials are looked up in batches with a multi-valued serialNumber filter, each batch paged with offset/limit,
+#then matched back to the mapping rows by serial. Returns the devices in mapping order and any serials DNAC doesn't know.
+def get_devices(client, serials):
+    batches = [serials[i:i + inventory_batch_size] for i in range(0, len(serials), inventory_batch_size)]
+
+    def get_batch(batch):
+        found = []
+        offset = 1
+        while True:
+            params = [('serialNumber', serial) for serial in batch] + [('offset', offset), ('limit', inventory_page_limit)]
+            page = client.get("/network-device", params=params).json()["response"]
+            found.extend(page)
+            if len(page) < inventory_page_limit:
+                return found
+            offset += inventory_page_limit
+
+    #Stacks report all member serials comma separated, so index every member serial
+    devices_by_serial = {}
+    for batch in client.map_concurrent(get_batch, batches):
+        for device in batch:
+            for serial in (device.get('serialNumber') or '').split(','):
+                devices_by_serial[serial.strip()] = device
+
+    devices = [devices_by_serial[serial] for serial in serials if serial in devices_by_serial]
+    missing_serials = [serial for serial in serials if serial not in devices_by_serial]
+    return devices, missing_serials
+
+#Based on the gather device info we now use the device id's to grab the existing config.
+#Configs are downloaded concurrently and yielded as (device id, config text) in device order
+#as soon as each one arrives, so the parser can start on the first config while the rest download.
+#Only the configs within the client's in-flight window are held at once, not the whole fleet's.
+#With a ConfigStore, configs of devices that haven't changed since they were stored are read locally
+def get_existing_config(client, devices, store=None): 
+
+    def get_config(device):
+        resp = store.get(device) if store else None
+        if resp is None:
+            with client.metrics.stage('config_fetch', items=1, cluster=client.cluster):
+                resp = client.get(f"/network-device/{device['id']}/config")
+                resp = resp.json()["response"]
+            if store:
+                store.put(device, resp)
+        return device['id'], resp
+
+    return client.imap(get_config, devices)
 
 #Will get information about the specified onboarding template, contains the template itself
-def get_template_details(token, onboarding_template):
-    headers = {
-        'content-type': "application/json",
-        'x-auth-token': token
-    }
-
-    url = f"https://{dnac}/dna/intent/api/v2/template-programmer/template?name={onboarding_template}"
-    resp = requests.request('GET', url=url, headers=headers, verify=False)
+def get_template_details(client, onboarding_template):
+    url = f"{client.root_url}/dna/intent/api/v2/template-programmer/template?name={onboarding_template}"
+    resp = client.get(url)
     resp = resp.json()['response'][0]
     return resp
 
-#Require site ids for pnp claiming
-def get_site_id(site_name): 
-    headers = {
-                'content-type': "application/json",
-                'x-auth-token': token
+#Require site ids for pnp claiming, resolved once per site name through the client's resolver cache
+def get_site_id(client, site_name): 
+
+    def lookup(site_name):
+        resp = client.get(f"/site?name={site_name}")
+        return resp.json()['response'][0]['id']
+
+    if client.resolver is None:
+        return lookup(site_name)
+    return client.resolver.resolve('site', site_name, lookup)
+
+#Devices per PnP import request and how often devices that failed to import are retried
+pnp_import_chunk_size = 50
+pnp_import_retries = 2
+
+#Import payload of one device, to note there are many more fields that can be added if required
+def pnp_import_item(device):
+    return {
+        "deviceInfo": {
+            "hostname": device["name"],
+            "serialNumber": device["serialNumber"],
+            "pid": device["pid"],
+            "sudiRequired": False,
+            "userSudiSerialNos": [],
+            "aaaCredentials": {
+                "username": "",
+                "password": ""
+            }
         }
-    url = base_url + f"/site?name={site_name}"
-    resp = requests.get(url=url, headers=headers, verify=False)
-    return resp.json()['response'][0]['id']
+    }
 
-#Imports devices to DNAC via pnp, to note there are many more fields that can be added if required
-def import_device_to_pnp(pnp_import_info):
-    
-    payload = []
-    headers = {
-                'content-type': "application/json",
-                'x-auth-token': token
-        }
+#PnP devices of the given serials, looked up in batches with a multi-valued serialNumber filter. Returns serial -> PnP device
+def find_pnp_devices(client, serials):
+    batches = [serials[i:i + inventory_batch_size] for i in range(0, len(serials), inventory_batch_size)]
+
+    def get_batch(batch):
+        return client.get("/onboarding/pnp-device", params=[('serialNumber', serial) for serial in batch]).json()
+
+    return {device['deviceInfo']['serialNumber']: device
+            for batch in client.map_concurrent(get_batch, batches) for device in batch}
+
+#Matches an import response back to the serials of its request by serial number, successList entries by
+#deviceInfo.serialNumber and failureList entries by serialNum. Serials the response doesn't mention failed.
+def reconcile_pnp_import(serials, response):
+    results = {serial: {'id': None, 'status': 'failed', 'reason': response.get('error', 'not in the import response')}
+               for serial in serials}
+    for item in response.get('failureList') or []:
+        if item.get('serialNum') in results:
+            results[item['serialNum']]['reason'] = item.get('msg')
+    for item in response.get('successList') or []:
+        serial = item.get('deviceInfo', {}).get('serialNumber')
+        if serial in results:
+            results[serial] = {'id': item['id'], 'status': 'imported', 'reason': None}
+    return results
+
+#Imports devices to DNAC via pnp in chunks of chunk_size devices, submitted concurrently. Results are matched
+#back by serial number and only the devices that failed are retried, up to retries more times. A device that
+#is already in PnP (e.g. imported by an interrupted run) keeps its existing PnP id.
+#Returns serial number -> {id, status 'imported' or 'failed', reason, attempts}
+def import_device_to_pnp(client, pnp_import_info, chunk_size=pnp_import_chunk_size, retries=pnp_import_retries):
     
+    devices = {}
     for device in pnp_import_info:
-
         print(device["serialNumber"])
-
-        formatted_item = {
-            "deviceInfo": {
-                "hostname": device["name"],
-                "serialNumber": device["serialNumber"],
-                "pid": device["pid"],
-                "sudiRequired": False,
-                "userSudiSerialNos": [],
-                "aaaCredentials": {
-                    "username": "",
-                    "password": ""
-                }
-            }
-        }
-        payload.append(formatted_item)
-
-    headers = {
-                'content-type': "application/json",
-                'x-auth-token': token
-        }
-    url = base_url + "/onboarding/pnp-device/import"
-    resp = requests.post(url=url, headers=headers, data=json.dumps(payload), verify=False)
-    return resp.json()
-
-
-def get_image_ids(token, image_names):
-
-    image_ids = []
-    for image_name in image_names:
+        devices[device["serialNumber"]] = device
+
+    def import_chunk(serials):
+        try:
+            resp = client.post("/onboarding/pnp-device/import", json=[pnp_import_item(devices[serial]) for serial in serials], check=False)
+            response = resp.json() if resp.ok else {'error': f"HTTP {resp.status_code}: {resp.text[:200]}"}
+        except Exception as e:
+            response = {'error': str(e)}
+        return reconcile_pnp_import(serials, response)
+
+    results = {}
+    pending = list(devices)
+    for attempt in range(1, retries + 2):
+        chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+        for chunk_results in client.map_concurrent(import_chunk, chunks):
+            for serial, result in chunk_results.items():
+                results[serial] = dict(result, attempts=attempt)
+
+        failed = [serial for serial in pending if results[serial]['status'] != 'imported']
+        if failed:
+            for serial, pnp_device in find_pnp_devices(client, failed).items():
+                results[serial].update(id=pnp_device['id'], status='imported', reason='already in PnP')
+        pending = [serial for serial in failed if results[serial]['status'] != 'imported']
+        if not pending or attempt > retries:
+            break
+        print(f"{len(pending)} devices failed to import to PnP, retrying.")
+
+    return results
+
+
+#Image uuids for the image file names of the mapping file, every distinct name is only looked up once
+def get_image_ids(client, image_names):
+
+    def lookup(image_name):
+        response = client.get(f"/image/importation?imageName={image_name}")
         
-        if type(image_name) == str:
-            url = f"{base_url}/image/importation?imageName={image_name}"
-            
-            headers = {
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-                'x-auth-token': token
-            }
+        #Response should only return one element since we filtered based on the image name
+        response = response.json()
+        return response['response'][0]['imageUuid']
 
-            response = requests.request('GET', url, headers=headers, data = None, verify=False)
-            
-            #Response should only return one element since we filtered based on the image name
-            response = response.json()
-            image_uuid = response['response'][0]['imageUuid']
+    def get_image_id(image_name):
+        if client.resolver is None:
+            return lookup(image_name)
+        return client.resolver.resolve('image', image_name, lookup)
 
-            image_ids.append(image_uuid)
-        else:   
-            image_ids.append(None)
+    unique_names = list(dict.fromkeys(name for name in image_names if type(name) == str))
+    image_ids = dict(zip(unique_names, client.map_concurrent(get_image_id, unique_names)))
 
-    return image_ids
+    return [image_ids.get(name) if type(name) == str else None for name in image_names]
 
 
-#Function to claim devices use finalised pnp info, filled template variables, along with the associated template id
-def claim_device_to_site(pnp_info, config_params, template_id, image_ids):
-    headers = {
-                'content-type': "application/json",
-                'x-auth-token': token
-        }
-    claim_all_devices = []
-    claim_results = []
+#Prepares the site-claim payload of every device before anything is submitted, all distinct site names are
+#resolved up front (concurrently, through the resolver cache). Returns a list of {serialNumber, deviceId, claim_info}
+def build_claim_payloads(client, pnp_info, config_params, template_id, image_ids):
+    site_names = list(dict.fromkeys(device['site_name'] for device in pnp_info))
+    site_ids = dict(zip(site_names, client.map_concurrent(lambda site_name: get_site_id(client, site_name), site_names)))
 
+    claims = []
     for device, device_config, image_id in zip(pnp_info, config_params, image_ids):
         
         #update old device name to new
+        device_config = dict(device_config)
         device_config['HOSTNAME'] = device['HOSTNAME']
-        site_name = device['site_name']
-        device_id = device['device_id']
-        site_id = get_site_id(site_name)
-
 
         claim_info = {
-            "siteId": site_id,
-            "deviceId": device_id,
+            "siteId": site_ids[device['site_name']],
+            "deviceId": device['device_id'],
             "type": "Default",
             "configInfo": {
                 "configId": template_id,
@@ -195,50 +258,403 @@ def claim_device_to_site(pnp_info, config_params, template_id, image_ids):
         if image_id != None:
             claim_info.update({"imageInfo": {"imageId": image_id, "skip": False}})
 
-        claim_all_devices.append(claim_info)
-        url = base_url + "/onboarding/pnp-device/site-claim"
-        resp = requests.post(url=url, headers=headers, json=claim_info, verify=False)
-        claim_results.append(resp.json())
+        claims.append({'serialNumber': device['serialNumber'], 'deviceId': device['device_id'], 'claim_info': claim_info})
+
+    return claims
+
+#Claims answered with one of these, a 5xx or no answer at all may succeed when submitted again, any other
+#error (e.g. 400 invalid site id) won't and is not retried
+def claim_retryable(status_code):
+    return status_code is None or status_code == 429 or status_code >= 500
+
+#Submits prepared claims concurrently, never more than rate claims per second. Claims that fail with a retryable
+#error are retried up to retries more times, after a backoff of delay seconds doubling per retry.
+#Returns serial number -> {deviceId, status, attempts, response}
+def submit_claims(client, claims, rate=claim_rate, retries=claim_retries, delay=claim_retry_delay):
+    bucket = TokenBucket(rate)
+    results = {}
+
+    def submit(claim):
+        bucket.acquire()
+        try:
+            resp = client.post("/onboarding/pnp-device/site-claim", json=claim['claim_info'], check=False)
+        except Exception as e:
+            return False, None, str(e)
+        try:
+            return resp.ok, resp.status_code, resp.json()
+        except ValueError:
+            return resp.ok, resp.status_code, resp.text[:500]
+
+    pending = claims
+    for attempt in range(1, retries + 2):
+        failed = []
+        for claim, (ok, status_code, response) in zip(pending, client.map_concurrent(submit, pending)):
+            results[claim['serialNumber']] = {'deviceId': claim['deviceId'], 'status': 'claimed' if ok else 'failed',
+                                              'attempts': attempt, 'response': response}
+            if not ok and claim_retryable(status_code):
+                failed.append(claim)
+        pending = failed
+        if not pending or attempt > retries:
+            break
+        print(f"{len(pending)} claims failed, retrying in {delay * 2 ** (attempt - 1)}s.")
+        time.sleep(delay * 2 ** (attempt - 1))
+
+    return results
 
-    print(claim_results)
-    return claim_results
-
-
-if __name__ == "__main__":
-    token = auth()
-
-    print("Read existing switch serial from mapping file.")
-    existing_serials = csv_column_to_list(0)
-    print(existing_serials)
-
-    print("Request switch details of existing switches via API e.g. Device ID.")
-    existing_devices = get_devices(token, existing_serials)
+#Function to claim devices use finalised pnp info, filled template variables, along with the associated template id
+def claim_device_to_site(client, pnp_info, config_params, template_id, image_ids):
 
-    print("Request config of existing switches via API.")
-    all_configs = get_existing_config(token, existing_devices)
-    
-    print("Request template details via API.")
-    template = get_template_details(token, onboarding_template)
-    template_list = config_transfer.template_text_to_list(template['templateContent'])
-    
-    print("Extracting of old configuration values.")
-    config_params = config_transfer.get_variables_from_config(all_configs, template_list)
-    pnp_info = config_transfer.format_list_for_pnp(config_params, onboarding_template)
-    
-    print("Read preferred switch image for new switches.")
-    image_names = csv_column_to_list(4)
-    image_ids = get_image_ids(token, image_names)
+    claims = build_claim_payloads(client, pnp_info, config_params, template_id, image_ids)
+    claim_results = submit_claims(client, claims)
 
-    print("Delete old switches.")
-    delete_old_devices.delete_old_switch(token, existing_devices)
+    print(claim_results)
+    return claim_results
 
-    print("Importing new switches to PNP:")
-    import_info = import_device_to_pnp(pnp_info)
-    pnp_info = config_transfer.extract_new_device_ids(pnp_info, import_info)
-    config_transfer.export_to_output_csv(pnp_info)
 
-    print("Claim new switches with associate template, old configuration values and optionally image version.")
-    claim_device_to_site(pnp_info, config_params, template['id'], image_ids)
+'''One migration run over the devices of the mapping file. Each stage is a method taking the old serials
+   of one wave, so the whole mapping file can run as a single wave or be pipelined wave by wave. Each device's
+   progress and the data each stage produced is recorded in the run journal, a device skips every stage the
+   journal already has, so an interrupted run resumes where each device stopped without fetching, deleting or
+   importing anything twice. Stages only keep their own wave's data, everything else is read from the journal.
+   mapping is the part of the mapping file on the client's cluster, by default the whole mapping file.'''
+class MigrationRun:
+
+    def __init__(self, client, journal, config_store=None, mapping=None, cluster=None):
+        self.client = client
+        self.journal = journal
+        self.config_store = config_store
+        self.cluster = cluster
+
+        print("Read existing switch serial from mapping file.")
+        self.mapping = load_mapping(mapping_file) if mapping is None else mapping
+        self.serials = self.mapping.old_serials()
+        print(self.serials)
+        self.site_names = {row.old_serial: row.site_name for row in self.mapping.rows}
+
+        self.template = None
+        self.template_list = None
+        self.compiled_template = None
+        self.preflight_report = None
+
+    #Stages in the order every wave goes through them
+    def stages(self):
+        return [('config', self.extract_configs), ('render', self.render), ('image', self.resolve_images),
+                ('delete', self.delete), ('import', self.import_pnp), ('claim', self.claim)]
+
+    #Fetches and compiles the onboarding template once per run, returns why it can't be used or None
+    def load_template(self):
+        if self.compiled_template is not None:
+            return None
+        print("Request template details via API.")
+        try:
+            self.template = get_template_details(self.client, onboarding_template)
+        except IndexError:
+            return f"template {onboarding_template} not found in DNAC"
+        self.template_list = config_transfer.template_text_to_list(self.template['templateContent'])
+        try:
+            self.compiled_template = template_render.compile_template(self.template['templateContent'], self.template['id'],
+                                                                      self.template.get('version'))
+        except TemplateSyntaxError as e:
+            return f"template {onboarding_template} can not be parsed, line {e.lineno}: {e.message}"
+        return None
+
+    '''Checks the whole mapping file before anything is deleted and prints the go/no-go report. The old serials
+       in the inventory, the new serials already in PnP and the template are looked up concurrently in bulk, then
+       every site and image with one listing each (see preflight.check_mapping). Devices found are journaled,
+       devices a resumed run already has are not looked up again. Returns the PreflightReport.'''
+    def preflight(self):
+        print("Pre-flight check of the mapping file: inventory, PnP, template, sites and images.")
+        journal = self.journal
+        pending = journal.pending(self.serials, 'device')
+        imported = {serial for serial in self.serials if journal.done(serial, 'pnp_import')}
+        new_serials = [self.mapping[serial].new_serial for serial in self.serials if serial not in imported]
+
+        lookups = [lambda: get_devices(self.client, pending) if pending else ([], []),
+                   lambda: find_pnp_devices(self.client, new_serials) if new_serials else {},
+                   self.load_template]
+        (found_devices, missing_serials), pnp_devices, template_problem = self.client.map_concurrent(lambda lookup: lookup(), lookups)
+
+        for serial, device in zip([serial for serial in pending if serial not in missing_serials], found_devices):
+            journal.record(serial, 'device', device)
+        devices = {serial: journal.get(serial, 'device') for serial in self.serials if journal.done(serial, 'device')}
+
+        self.preflight_report = preflight.check_mapping(self.client, self.mapping, devices, pnp_devices, self.compiled_template,
+                                                        onboarding_template, template_problem, skip_pnp=imported,
+                                                        cluster=self.cluster)
+        self.preflight_report.print_report()
+        return self.preflight_report
+
+    #Looked up for the whole mapping file before any wave starts, so unknown serials stop the run up front
+    def fetch_devices(self):
+        print("Request switch details of existing switches via API e.g. Device ID.")
+        pending = self.journal.pending(self.serials, 'device')
+        if pending:
+            found_devices, missing_serials = get_devices(self.client, pending)
+            if missing_serials:
+                raise SystemExit(f"Serials not found in the DNAC inventory, fix the mapping file before continuing: {missing_serials}")
+            for serial, device in zip(pending, found_devices):
+                self.journal.record(serial, 'device', device)
+
+        template_problem = self.load_template()
+        if template_problem:
+            raise SystemExit(f"Can't continue, {template_problem}")
+
+    def extract_configs(self, serials):
+        print("Request config of existing switches via API and extract old configuration values as they arrive.")
+        journal = self.journal
+        pending = journal.pending(serials, 'params')
+        if not pending:
+            return
+        devices = {serial: journal.get(serial, 'device') for serial in pending}
+        downloads = get_existing_config(self.client, [devices[serial] for serial in pending if not journal.done(serial, 'config')],
+                                        self.config_store)
+
+        #Configs downloaded by an earlier attempt are read back from the journal, new ones are journaled as they arrive
+        def journaled_configs():
+            for serial in pending:
+                if journal.done(serial, 'config'):
+                    yield devices[serial]['id'], journal.get(serial, 'config')
+                else:
+                    device_id, config = next(downloads)
+                    journal.record(serial, 'config', config)
+                    yield device_id, config
+
+        #New switch pid of every old device, selects the interface translations to apply.
+        #Each device's values are journaled as soon as they are extracted and not kept by this stage,
+        #so memory depends on how many configs are in flight, not on the size of the wave
+        new_pids = {devices[serial]['id']: self.mapping[serial].pid for serial in pending}
+        params = config_transfer.iter_variables_from_config(journaled_configs(), self.template_list, pids=new_pids,
+                                                            cluster=self.client.cluster)
+        for serial, device_params in zip(pending, params):
+            journal.record(serial, 'params', device_params)
+
+    #Every device's day-0 config is rendered locally before anything is deleted, devices with undefined
+    #template variables or an oversized config are rejected here instead of failing provisioning after the claim
+    def render(self, serials):
+        print("Render the onboarding template locally with the extracted values.")
+        journal = self.journal
+        rendered = lambda result: result['ok']
+        pending = journal.pending(serials, 'render', ok=rendered)
+        if not pending:
+            return
+        results = template_render.check_renders(self.compiled_template, (journal.get(serial, 'params') for serial in pending),
+                                                template_max_bytes)
+        for serial, result in zip(pending, results):
+            journal.record(serial, 'render', result)
+        rejected = {serial: result['problems'] for serial, result in zip(pending, results) if not result['ok']}
+        if rejected:
+            print(f"Switches rejected, the template can not be rendered for them (not deleted or claimed): {rejected}")
+
+    #Serials that passed the render check, only these are deleted, imported and claimed
+    def rendered(self, serials):
+        return [serial for serial in serials if self.journal.get(serial, 'render', {}).get('ok')]
+
+    #Serials whose old switch is deleted. A new switch comes up with the old hostname and management IP,
+    #importing or claiming it while the old device is still in the inventory would duplicate that IP
+    def deleted(self, serials, stage):
+        deleted = [serial for serial in serials if (self.journal.get(serial, 'delete') or {}).get('status') == 'deleted']
+        skipped = {serial: self.journal.get(serial, 'delete') for serial in serials if serial not in deleted}
+        if skipped:
+            print(f"Switches skipped, their old switch was not deleted (not {stage}ed): {skipped}")
+        return deleted
+
+    def resolve_images(self, serials):
+        print("Read preferred switch image for new switches.")
+        pending = self.journal.pending(serials, 'image')
+        for serial, image_id in zip(pending, get_image_ids(self.client, [self.mapping[serial].image_version for serial in pending])):
+            self.journal.record(serial, 'image', image_id)
+
+    def delete(self, serials):
+        print("Delete old switches.")
+        journal = self.journal
+        deleted = lambda result: result['status'] == 'deleted'
+        serials = self.rendered(serials)
+        pending = journal.pending(serials, 'delete', ok=deleted)
+        #Deletions that timed out are not sent again, their task is checked instead
+        running_tasks = {}
+        for serial in pending:
+            result = journal.get(serial, 'delete')
+            if result and result['status'] == 'timeout' and result.get('task_id'):
+                running_tasks[journal.get(serial, 'device')['id']] = result['task_id']
+        delete_results = delete_old_devices.delete_old_switch(self.client, [journal.get(serial, 'device') for serial in pending],
+                                                              running_tasks)
+        for serial in pending:
+            journal.record(serial, 'delete', delete_results[journal.get(serial, 'device')['id']])
+        failed_deletes = {serial: journal.get(serial, 'delete') for serial in journal.pending(serials, 'delete', ok=deleted)}
+        if failed_deletes:
+            print(f"Old switches not deleted: {failed_deletes}")
+
+    #PnP details of the new switches, rebuilt from the extracted values and mapping file each time they are needed.
+    #The import record only holds the PnP device id, which is added once a device has been imported
+    def pnp_info(self, serials):
+        pnp_info = config_transfer.format_list_for_pnp([self.journal.get(serial, 'params') for serial in serials],
+                                                       onboarding_template, [self.mapping[serial] for serial in serials])
+        import_results = {self.mapping[serial].new_serial: {'id': self.journal.get(serial, 'pnp_import')['device_id'], 'status': 'imported'}
+                          for serial in serials if self.journal.done(serial, 'pnp_import')}
+        return config_transfer.extract_new_device_ids(pnp_info, import_results)
+
+    def import_pnp(self, serials):
+        print("Importing new switches to PNP:")
+        pending = self.journal.pending(self.deleted(self.rendered(serials), 'import'), 'pnp_import')
+        if not pending:
+            return
+        pnp_info = self.pnp_info(pending)
+        import_results = import_device_to_pnp(self.client, pnp_info)
+        for serial, device in zip(pending, config_transfer.extract_new_device_ids(pnp_info, import_results)):
+            if 'device_id' in device:
+                self.journal.record(serial, 'pnp_import', {'serialNumber': device['serialNumber'], 'device_id': device['device_id']})
+        failed_imports = {device['serialNumber']: import_results[device['serialNumber']]['reason']
+                          for device in pnp_info if import_results[device['serialNumber']]['status'] != 'imported'}
+        if failed_imports:
+            print(f"New switches not imported to PnP: {failed_imports}")
+
+    def claim(self, serials):
+        print("Claim new switches with associate template, old configuration values and optionally image version.")
+        journal = self.journal
+        claimed = lambda result: result['status'] == 'claimed'
+        pending = [serial for serial in journal.pending(self.deleted(self.rendered(serials), 'claim'), 'claim', ok=claimed)
+                   if journal.done(serial, 'pnp_import')]
+        if not pending:
+            return
+        pnp_info = self.pnp_info(pending)
+        claim_results = claim_device_to_site(self.client, pnp_info, [journal.get(serial, 'params') for serial in pending],
+                                             self.template['id'], [journal.get(serial, 'image') for serial in pending])
+        for serial, device in zip(pending, pnp_info):
+            journal.record(serial, 'claim', claim_results[device['serialNumber']])
+
+    '''Runs the whole migration, waves is a list of serial lists (default: the whole mapping file at once),
+       stage_limits how many waves may be in each stage at the same time'''
+    def run(self, waves=None, stage_limits=None):
+        if self.preflight_report is None:
+            self.preflight()
+        if not self.preflight_report.go:
+            raise SystemExit("Pre-flight check failed, nothing was changed. Fix the problems above and run again.")
+        self.fetch_devices()
+        run_waves(waves or [self.serials], self.stages(), stage_limits, self.client.cluster)
+        return {serial: self.journal.get(serial, 'claim') for serial in self.serials}
+
+    #Where a device stands: claimed or failed once claimed, rejected by the render check, not deleted when
+    #the old switch could not be deleted, otherwise incomplete
+    def status(self, serial):
+        claim = self.journal.get(serial, 'claim')
+        if claim:
+            return claim['status']
+        render = self.journal.get(serial, 'render')
+        if render and not render['ok']:
+            return 'rejected'
+        delete = self.journal.get(serial, 'delete')
+        if delete and delete['status'] != 'deleted':
+            return 'not deleted'
+        return 'incomplete'
+
+
+#Runs func(migration) for the migration of every cluster at once, returns cluster name -> result or the exception raised
+def for_each_cluster(migrations, func):
+    with ThreadPoolExecutor(max_workers=len(migrations) or 1) as executor:
+        futures = {name: executor.submit(func, migration) for name, migration in migrations.items()}
+    return {name: future.exception() or future.result() for name, future in futures.items()}
+
+'''Merges the results of every cluster into one onboarding file (config/onboarding.csv, every switch with
+   its cluster and status), returns cluster name -> {status: number of switches}. Switches of a cluster that
+   stopped before their values were extracted are listed with their mapping file details only. Rows are
+   rebuilt from the journal and written one at a time, the header is fixed up front.'''
+def merge_results(migrations):
+    summary = {}
+    template_lists = [migration.template_list for migration in migrations.values() if migration.template_list]
+    headers = config_transfer.onboarding_columns + config_transfer.variable_columns(template_lists) + ['cluster', 'status']
+
+    def rows():
+        for name, migration in migrations.items():
+            summary[name] = {}
+            for serial in migration.serials:
+                if migration.journal.done(serial, 'params'):
+                    device = migration.pnp_info([serial])[0]
+                else:
+                    row = migration.mapping[serial]
+                    device = {'serialNumber': row.new_serial, 'pid': row.pid, 'site_name': row.site_name,
+                              'template_name': onboarding_template}
+                status = migration.status(serial)
+                summary[name][status] = summary[name].get(status, 0) + 1
+                yield dict(device, cluster=name, status=status)
+
+    if migrations:
+        config_transfer.export_to_output_csv(rows(), headers)
+    return summary
+
+
+#Stage limits are given as stage=waves, e.g. --stage-limit config=2
+def parse_stage_limits(values):
+    limits = {}
+    for value in values or []:
+        name, _, limit = value.partition('=')
+        limits[name] = int(limit)
+    return limits
 
 
-    
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate Catalyst 3k switches to Catalyst 9k via DNA Center PnP.")
+    parser.add_argument('--refresh-cache', action='store_true', help="Drop cached site and image ids and look them up again.")
+    parser.add_argument('--resume', metavar='JOURNAL', help="Resume an interrupted run from its journal file (runs/<run id>.jsonl).")
+    parser.add_argument('--wave-size', type=int, help="Migrate the mapping file in waves of this many switches, pipelined stage by stage.")
+    parser.add_argument('--waves-by-site', action='store_true', help="One wave per site_name (split further by --wave-size if given).")
+    parser.add_argument('--no-config-cache', action='store_true', help="Always download running configs, ignore the local config store.")
+    parser.add_argument('--metrics-json', metavar='FILE', help="Write API call, stage and parser metrics of the run as JSON.")
+    parser.add_argument('--metrics-prom', metavar='FILE', help="Write the metrics as a Prometheus textfile (node exporter textfile collector).")
+    parser.add_argument('--preflight-only', action='store_true', help="Only run the pre-flight check of the mapping file, change nothing.")
+    parser.add_argument('--preflight-report', metavar='FILE', help="Write the pre-flight go/no-go report as JSON.")
+    parser.add_argument('--stage-limit', action='append', metavar='STAGE=N',
+                        help="How many waves may be in a stage at once (stages: config, render, image, delete, import, claim), default 1.")
+    args = parser.parse_args()
+
+    journal_path = args.resume or f"runs/{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl"
+    print(f"Run journal: {journal_path} (resume with --resume {journal_path})")
+    journal = RunJournal(journal_path)
+    try:
+        try:
+            shards = clusters.route(load_mapping(mapping_file), profiles)
+        except MappingError as e:
+            raise SystemExit(f"Invalid mapping file: {e}")
+
+        #One client, config store and migration per cluster, all sharing the run journal
+        migrations = {}
+        for profile in profiles:
+            if profile.name not in shards:
+                continue
+            client = auth(profile)
+            if args.refresh_cache:
+                client.resolver.invalidate()
+            config_store = None if args.no_config_cache else ConfigStore(f".cache/configs_{profile.cache_name}")
+            migrations[profile.name] = MigrationRun(client, journal, config_store, shards[profile.name], profile.name)
+
+        reports = for_each_cluster(migrations, lambda migration: migration.preflight())
+        for report in reports.values():
+            if isinstance(report, BaseException):
+                raise report
+        if args.preflight_report:
+            with open(args.preflight_report, 'w') as report_file:
+                json.dump({'go': all(report.go for report in reports.values()),
+                           'clusters': {name: report.to_dict() for name, report in reports.items()}}, report_file, indent=2)
+        no_go = [name for name, report in reports.items() if not report.go]
+        if args.preflight_only:
+            raise SystemExit(1 if no_go else 0)
+        if no_go:
+            raise SystemExit(f"Pre-flight check failed on cluster {', '.join(no_go)}, nothing was changed. Fix the problems above and run again.")
+
+        stage_limits = parse_stage_limits(args.stage_limit)
+        results = for_each_cluster(migrations, lambda migration: migration.run(
+            split_waves(migration.serials, migration.site_names, args.wave_size, args.waves_by_site), stage_limits))
+
+        failed_clusters = {name: result for name, result in results.items() if isinstance(result, BaseException)}
+        for name, error in failed_clusters.items():
+            print(f"Cluster {name} stopped, {type(error).__name__}: {error}")
+        print("Results per cluster (details in config/onboarding.csv):")
+        for name, summary in merge_results(migrations).items():
+            print(f"  {name}: " + ", ".join(f"{count} {status}" for status, count in summary.items()))
+        if failed_clusters:
+            raise SystemExit(f"Migration stopped on cluster {', '.join(failed_clusters)}, resume with --resume {journal_path}")
+    finally:
+        journal.close()
+        if args.metrics_json:
+            metrics.registry.write_json(args.metrics_json)
+        if args.metrics_prom:
+            metrics.registry.write_prometheus(args.metrics_prom)
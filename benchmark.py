@@ -0,0 +1,136 @@
+""" Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+           https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import argparse, json, os, resource, shutil, subprocess, sys, tempfile, time
+import requests
+
+'''End-to-end throughput benchmark of the migration against the local DNAC stand-in (mock_dnac.py).
+   For every fleet size a fresh mock DNAC and working directory are started, the full migration runs in
+   its own process, and the end-to-end and per-stage wall time, API calls per endpoint and peak memory
+   (max RSS of the migration process) are reported. Example:
+       python3 benchmark.py --sizes 10 100 1000 5000 --latency default=0.05 --output bench.json
+   The migration reads its settings from the environment as usual, e.g. DNAC_API_RATE=50 python3 benchmark.py'''
+
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+#MigrationRun methods timed as stages, a stage run once per wave is summed over the waves
+timed_stages = ['fetch_devices', 'extract_configs', 'render', 'resolve_images', 'delete', 'import_pnp', 'claim']
+
+
+#Runs inside the measured process: one full migration against the mock at url, from workdir
+def measure(url, workdir, app_args):
+    os.chdir(workdir)
+    os.environ.update(DNAC_HOST=url, USERNAME='benchmark', PASSWORD='benchmark',
+                      DNAC_PROJECT_NAME='benchmark', DAY0_TEMPLATE='benchmark')
+    sys.path.insert(0, repo_dir)
+    import app
+    from run_journal import RunJournal
+    from orchestrator import split_waves
+
+    stage_times = {name: 0.0 for name in timed_stages}
+
+    def timed(name, stage):
+        def run(*args):
+            started = time.perf_counter()
+            try:
+                return stage(*args)
+            finally:
+                stage_times[name] += time.perf_counter() - started
+        return run
+
+    started = time.perf_counter()
+    client = app.auth()
+    journal = RunJournal('runs/benchmark.jsonl')
+    migration = app.MigrationRun(client, journal)
+    for name in timed_stages:
+        setattr(migration, name, timed(name, getattr(migration, name)))
+    waves = split_waves(migration.serials, migration.site_names, app_args.get('wave_size'))
+    results = migration.run(waves, app_args.get('stage_limits'))
+    journal.close()
+
+    return {
+        'total_seconds': round(time.perf_counter() - started, 3),
+        'stage_seconds': {name: round(seconds, 3) for name, seconds in stage_times.items()},
+        'claimed': sum(1 for result in results.values() if result and result['status'] == 'claimed'),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+#Starts a mock DNAC for size devices in its own process, returns the process and its url
+def start_mock(size, workdir, args):
+    command = [sys.executable, os.path.join(repo_dir, 'mock_dnac.py'), '--port', '0', '--devices', str(size),
+               '--task-duration', str(args.task_duration), '--mapping', os.path.join(workdir, 'config', 'mapping.csv')]
+    for value in args.latency or []:
+        command += ['--latency', value]
+    for value in args.error or []:
+        command += ['--error', value]
+    mock = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    url = mock.stdout.readline().strip().rsplit(' ', 1)[-1]
+    return mock, url
+
+
+def run_size(size, args):
+    workdir = tempfile.mkdtemp(prefix=f"dnac-bench-{size}-")
+    os.makedirs(os.path.join(workdir, 'config'))
+    shutil.copy(os.path.join(repo_dir, 'config', 'interface_translation.csv'), os.path.join(workdir, 'config'))
+    mock, url = start_mock(size, workdir, args)
+    try:
+        app_args = json.dumps({'wave_size': args.wave_size, 'stage_limits': {}})
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', url, workdir, app_args],
+                               capture_output=True, text=True)
+        if child.returncode != 0:
+            raise SystemExit(f"Benchmark with {size} devices failed:\n{child.stderr[-3000:]}")
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        result['devices'] = size
+        result['api_calls'] = requests.get(f"{url}/mock/calls").json()
+        result['api_calls_total'] = sum(result['api_calls'].values())
+        return result
+    finally:
+        mock.terminate()
+        mock.wait()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_report(results):
+    print(f"{'devices':>8} {'total s':>9} {'calls':>7} {'rss MB':>7}  " + " ".join(f"{name:>15}" for name in timed_stages))
+    for result in results:
+        print(f"{result['devices']:>8} {result['total_seconds']:>9} {result['api_calls_total']:>7} {result['peak_rss_mb']:>7}  "
+              + " ".join(f"{result['stage_seconds'][name]:>15}" for name in timed_stages))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == '--measure':
+        print(json.dumps(measure(sys.argv[2], sys.argv[3], json.loads(sys.argv[4]))))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Benchmark the migration against a local DNAC stand-in.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--latency', action='append', help="Per endpoint latency passed to mock_dnac.py, e.g. default=0.05")
+    parser.add_argument('--error', action='append', help="Error injection passed to mock_dnac.py, e.g. site_claim=error:0.05")
+    parser.add_argument('--task-duration', type=float, default=2.0, help="Seconds until a mock deletion task finishes")
+    parser.add_argument('--wave-size', type=int, help="Run the migration in waves of this size")
+    parser.add_argument('--output', help="Also write the results as JSON to this file")
+    parser.add_argument('--keep', action='store_true', help="Keep the working directories (journal, onboarding.csv)")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        results.append(run_size(size, args))
+        print(f"{size} devices: {results[-1]['total_seconds']}s")
+
+    print()
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
@@ -0,0 +1,84 @@
+""" Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+           https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import os
+from collections import namedtuple
+from mapping import Mapping, MappingError
+
+'''Connection profiles of several DNA Center clusters, read from the environment (.env):
+       DNAC_CLUSTERS= emea, amer
+       DNAC_HOST_EMEA= 10.1.1.1
+       USERNAME_EMEA= admin                     (optional, default USERNAME)
+       PASSWORD_EMEA= secret                    (optional, default PASSWORD)
+       DNAC_MAX_WORKERS_EMEA= 4                 (optional, default DNAC_MAX_WORKERS)
+       DNAC_API_RATE_EMEA= 5                    (optional, default DNAC_API_RATE)
+       SITE_PREFIXES_EMEA= Global/Europe;Global/Africa   (optional, see route)
+   Without DNAC_CLUSTERS, DNAC_HOST, USERNAME and PASSWORD are the single cluster "default".'''
+ClusterProfileBase = namedtuple('ClusterProfile', ['name', 'host', 'username', 'password', 'max_workers', 'api_rate', 'site_prefixes'])
+
+class ClusterProfile(ClusterProfileBase):
+
+    #Local caches (resolved ids, stored configs) are kept per DNAC host
+    @property
+    def cache_name(self):
+        return self.host.split('://')[-1].replace(':', '_')
+
+
+def load_profiles(max_workers, api_rate, environ=os.environ):
+    names = [name.strip().lower() for name in environ.get("DNAC_CLUSTERS", "").split(',') if name.strip()]
+    if not names:
+        return [ClusterProfile('default', environ["DNAC_HOST"], environ["USERNAME"], environ["PASSWORD"], max_workers, api_rate, ())]
+
+    profiles = []
+    for name in names:
+        setting = lambda key, default=None: environ.get(f"{key}_{name.upper()}", default)
+        prefixes = tuple(prefix.strip().rstrip('/') for prefix in setting("SITE_PREFIXES", "").split(';') if prefix.strip())
+        profiles.append(ClusterProfile(name, environ[f"DNAC_HOST_{name.upper()}"],
+                                       setting("USERNAME", environ.get("USERNAME")), setting("PASSWORD", environ.get("PASSWORD")),
+                                       int(setting("DNAC_MAX_WORKERS", max_workers)), float(setting("DNAC_API_RATE", api_rate)),
+                                       prefixes))
+    return profiles
+
+
+#The profile whose site prefix is the longest match of site_name, a prefix matches whole site levels only
+def match_site_prefix(profiles, site_name):
+    matches = [(len(prefix), profile) for profile in profiles for prefix in profile.site_prefixes
+               if site_name == prefix or site_name.startswith(prefix + '/')]
+    return max(matches, key=lambda match: match[0])[1] if matches else None
+
+
+'''Splits the mapping file into one Mapping per cluster, in mapping order. A row goes to the cluster of its
+   cluster column, otherwise to the cluster with the longest site prefix matching its site_name, otherwise,
+   with a single cluster, to that cluster. Rows that can't be routed are reported together in one MappingError.
+   Returns cluster name -> Mapping, only clusters with rows are included.'''
+def route(mapping, profiles):
+    by_name = {profile.name: profile for profile in profiles}
+    rows = {}
+    problems = []
+
+    for row in mapping.rows:
+        if row.cluster:
+            profile = by_name.get(row.cluster.lower())
+            if profile is None:
+                problems.append(f"line {row.line}: unknown cluster {row.cluster}, expected one of {list(by_name)}")
+                continue
+        else:
+            profile = match_site_prefix(profiles, row.site_name) or (profiles[0] if len(profiles) == 1 else None)
+            if profile is None:
+                problems.append(f"line {row.line}: no cluster column and no cluster site prefix matches {row.site_name}")
+                continue
+        rows.setdefault(profile.name, []).append(row)
+
+    if problems:
+        raise MappingError("; ".join(problems))
+    return {name: Mapping(rows[name]) for name in by_name if name in rows}
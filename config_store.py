@@ -0,0 +1,118 @@
+""" Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+           https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import argparse, gzip, hashlib, json, os, threading
+import config_transfer
+
+'''Local store of downloaded running configs. Config texts are stored gzip compressed under their
+   sha256 digest (objects/ab/abcdef....gz), so identical configs are only stored once. A small ref
+   file per device (refs/<device id>.json) records which digest belongs to which inventory version of
+   the device, the version being the inventory's lastUpdateTime (or lastUpdated). As long as DNAC
+   reports the same version for a device its config is read from the store instead of downloaded.'''
+class ConfigStore:
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'refs'), exist_ok=True)
+
+    @staticmethod
+    def version(device):
+        return str(device.get('lastUpdateTime') or device.get('lastUpdated') or '')
+
+    def object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest + '.gz')
+
+    def ref_path(self, device_id):
+        return os.path.join(self.directory, 'refs', device_id + '.json')
+
+    def read_ref(self, device_id):
+        try:
+            with open(self.ref_path(device_id), 'r') as ref_file:
+                return json.load(ref_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def read_object(self, digest):
+        with gzip.open(self.object_path(digest), 'rt', encoding='utf-8') as object_file:
+            return object_file.read()
+
+    #The stored config of an inventory device, None if it was never stored or the device changed since
+    def get(self, device):
+        ref = self.read_ref(device['id'])
+        version = self.version(device)
+        if ref is None or not version or ref['version'] != version:
+            return None
+        try:
+            return self.read_object(ref['digest'])
+        except FileNotFoundError:
+            return None
+
+    def put(self, device, config_text):
+        digest = hashlib.sha256(config_text.encode('utf-8')).hexdigest()
+        #Written under a name unique to the thread, then renamed, so readers never see half a file
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with gzip.open(path + suffix, 'wt', encoding='utf-8') as object_file:
+                object_file.write(config_text)
+            os.replace(path + suffix, path)
+
+        ref = {'device_id': device['id'], 'serialNumber': device.get('serialNumber'),
+               'hostname': device.get('hostname'), 'version': self.version(device), 'digest': digest}
+        ref_path = self.ref_path(device['id'])
+        with open(ref_path + suffix, 'w') as ref_file:
+            json.dump(ref, ref_file)
+        os.replace(ref_path + suffix, ref_path)
+        return digest
+
+    #Latest stored config of every device (or of the given device ids) as (device id, config text)
+    def configs(self, device_ids=None):
+        if device_ids is None:
+            device_ids = sorted(name[:-len('.json')] for name in os.listdir(os.path.join(self.directory, 'refs'))
+                                if name.endswith('.json'))
+        for device_id in device_ids:
+            ref = self.read_ref(device_id)
+            if ref is not None:
+                yield device_id, self.read_object(ref['digest'])
+
+
+#Runs the value extraction straight from the store, e.g. to try template or extraction rule changes
+#against every stored config without downloading anything:
+#    python3 config_store.py .cache/configs_<dnac host> example_template.txt --output params.json
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract template values from the stored running configs.")
+    parser.add_argument('store', help="Config store directory, e.g. .cache/configs_<dnac host>")
+    parser.add_argument('template', help="Jinja onboarding template file")
+    parser.add_argument('--output', help="Write the extracted values as JSON to this file instead of printing them")
+    args = parser.parse_args()
+
+    store = ConfigStore(args.store)
+    with open(args.template, 'r') as template_file:
+        template_list = config_transfer.template_text_to_list(template_file.read())
+
+    device_ids = []
+
+    def stored_configs():
+        for device_id, config_text in store.configs():
+            device_ids.append(device_id)
+            yield device_id, config_text
+
+    params = config_transfer.get_variables_from_config(stored_configs(), template_list)
+    results = dict(zip(device_ids, params))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
@@ -11,7 +11,10 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied. 
 """
 
-import re, csv, copy
+import re, csv, copy, time
+import metrics, template_render
+from collections import namedtuple
+from functools import lru_cache
 
 #Function to convert onboarding template to a list ready for analysis
 def template_text_to_list(template_text):
@@ -20,76 +23,275 @@ def template_text_to_list(template_text):
         template_list.append(line)
     return template_list
 
-#Extracts jinja lines from the template, produces dictionary of keys representing unique template variables
+#Produces a dictionary of keys representing the unique variables of the template (text or list of lines).
+#The template is parsed by jinja (see template_render), so variables used in {% for %} and {% if %} blocks
+#are found and loop variables are not
 def get_variables_from_template(template):
-    template_var_lines = []
-    var_values_dict = {}
-
-    for line in template:
-        if "{{" in line and "}}" in line:
-            template_var_lines.append(line)
-
-    for line in template_var_lines:
-        #This pattern is searching for "{{ }}" which denotes a template variable in jinja
-        matches = re.findall(r'\{\{\s*(\w+)\s*\}\}', line)
-        for match in matches:
-            var_values_dict[match] = None
-
-    return var_values_dict
-
-
-'''Extract old switch config (and translate interface names according to new syntax)'''
-def extract_old_interface_config(config):
-
+    if not isinstance(template, str):
+        template = "\n".join(template)
+    return dict.fromkeys(template_render.compile_template(template).variables)
+
+
+'''Lines of a config text buffer from offset start up to end. The buffer is split block_size characters at
+   a time instead of into one list of every line, lines are split like splitlines() would.'''
+def iter_lines(text, start=0, end=None, block_size=65536):
+    end = len(text) if end is None else end
+    while start < end:
+        block_end = text.find("\n", min(start + block_size, end), end)
+        if block_end == -1:
+            block_end = end
+        yield from text[start:block_end].splitlines()
+        start = block_end + 1
+
+#Lines that are not indented (including empty lines), they start a new stanza and close the previous one
+top_level_line = re.compile(r'^(?![^\S\r\n]).*', re.MULTILINE)
+
+
+'''A top level stanza of a running config, e.g. "interface GigabitEthernet1/0/2" and its indented child lines.
+   kind is the first word of the header (interface, vlan, router, hostname...), name is the rest of the header,
+   start and end are offsets into the config text of the header and of the end of its last child line.'''
+Section = namedtuple('Section', ['kind', 'name', 'header', 'start', 'end'])
+
+'''Index of a running config built in one pass, top level stanzas are grouped by kind and name so
+   selecting an interface, vlan or the management SVI is a dictionary lookup instead of a rescan.
+   A stanza ends at the next top level line, so "!", "lldp run" or the end of the file all close it.
+   The config is kept as the single text buffer it was downloaded as, sections only hold offsets into it,
+   so no per-line copies of the config are made. A list or other iterable of lines is joined into one buffer.'''
+class ConfigIndex:
+
+    def __init__(self, config):
+        self.text = config if isinstance(config, str) else "\n".join(line.rstrip("\r\n") for line in config)
+        self.sections = []
+        self.by_kind = {}
+
+        text = self.text
+        self.line_count = text.count("\n") + (1 if text and not text.endswith("\n") else 0)
+
+        #Only the top level lines are visited, a stanza's children are everything up to the next one
+        section = None
+        for match in top_level_line.finditer(text):
+            if section is not None:
+                end = match.start() - 1
+                self.add_section(Section(*section, end - 1 if text[end - 1:end] == "\r" else end))
+                section = None
+
+            line = match.group().rstrip("\r")
+            if line.strip() and not line.startswith('!'):
+                kind, _, name = line.partition(' ')
+                section = [kind, name.strip(), line, match.start()]
+
+        if section is not None:
+            self.add_section(Section(*section, len(text)))
+
+    def add_section(self, section):
+        self.sections.append(section)
+        self.by_kind.setdefault(section.kind, {})[section.name] = section
+
+    #All sections of one kind in config order, e.g. index.find('vlan')
+    def find(self, kind):
+        return list(self.by_kind.get(kind, {}).values())
+
+    #A single section, e.g. index.get('interface', 'Vlan14'), None if the config doesn't have it
+    def get(self, kind, name):
+        return self.by_kind.get(kind, {}).get(name)
+
+    #Every line of the config, or of one section (header and children)
+    def iter_lines(self, section=None):
+        if section is None:
+            return iter_lines(self.text)
+        return iter_lines(self.text, section.start, section.end)
+
+    #The indented child lines of a section
+    def children(self, section):
+        lines = self.iter_lines(section)
+        next(lines)
+        return lines
+
+
+#Interfaces carried over to the new switch, Gi1/0/2 - Gi1/0/48 and Te1/1/3 - Te1/1/4
+match_gig = re.compile(r'([1]\/[0]\/([2-9]|(1[0-9])|(2[0-9])|(3[0-9])|(4[0-8])))$')
+match_ten = re.compile(r'([1]\/[1]\/(3|4))$')
+
+def is_transferred_interface(name):
+    return ((name.startswith('Ten') and match_ten.search(name)) or (name.startswith('Gi') and match_gig.search(name))
+            or name.startswith('Port-channel1') or name.startswith('Vlan'))
+
+
+'''Extract old switch config and translate interface names according to the syntax of the new switch pid,
+   config is the config text, a list of config lines or an already built ConfigIndex. Lines are translated
+   as they are read from the config buffer, the returned list is the only copy made.'''
+def extract_old_interface_config(config, pid=None):
+
+    index = config if isinstance(config, ConfigIndex) else ConfigIndex(config)
+    translations = get_interface_translations(pid)
     interface_config = []
 
-    for i, line in enumerate(config):
-
-        match_gig = re.search(r'([1]\/[0]\/([2-9]|(1[0-9])|(2[0-9])|(3[0-9])|(4[0-8])))$', line)
-        match_ten = re.search(r'([1]\/[1]\/(3|4))$', line)
+    for section in index.sections:
 
-        if (line.startswith('interface Ten') and match_ten) or (line.startswith('interface Gi') and match_gig) or line.startswith('interface Port-channel1') or line.startswith('vlan') or line.startswith('interface Vlan'):
+        if section.kind == 'vlan' or (section.kind == 'interface' and is_transferred_interface(section.name)):
             
-            interface_config.append(line)
-            #OR (in case of translations)
-            #translated_line = translate_interface_syntax(config[i])
-            #interface_config.append(translated_line)
-            
-            #Copy all lines until ! or lldp run 
-            while (config[i+1] != "!" and config[i+1] != "lldp run"):
-                interface_config.append(config[i+1])
-                i = i+1
-            
-            #Skip duplicate !
-            while config[i+1] == "!":
-                i = i+1 
+            lines = index.iter_lines(section)
+            if translations:
+                lines = (translate_interface_syntax(line, translations=translations) for line in lines)
+            interface_config.extend(lines)
             interface_config.append("!")
 
-
     return interface_config
 
 
-'''Translate interface names according to new syntax
-GigabitEthernet1/0/37- GigabitEthernet1/0/48 to TenGigabitEthernet1/0/x
-GigabitEthernet1/1/1 - GigabitEthernet1/1/2 To TenGigabitEthernet1/1/x
-not needed with test switch but for real switch in PoC
-'''
-def translate_interface_syntax(line):
-    
-    match = re.search(r'[1]\/[1]\/[1-2]$', line) or re.search(r'[1]\/[0]\/((3[7-9])|(4[0-8]))$', line)
+'''Interface translation table, one row per renamed port range of a new switch pid (pid column of mapping.csv):
+   pid,source_type,slot,port_start,port_end,target_type,target_slot,port_offset
+   e.g. C9300-48UXM,GigabitEthernet,1/0,37,48,TenGigabitEthernet,,
+   renames GigabitEthernet1/0/37 - GigabitEthernet1/0/48 to TenGigabitEthernet1/0/x. Empty target_slot keeps
+   the slot, port_offset is added to the port number. Ranges are expanded once into a dictionary per pid keyed by
+   (interface type, slot, port), so translating an interface name is a single lookup.'''
+translation_file = 'config/interface_translation.csv'
 
-    if match and line.startswith('interface Gig'):
-        line = line.replace("GigabitEthernet", "TenGigabitEthernet")
+#Matches interface names anywhere in a line, e.g. "GigabitEthernet1/0/37" -> ('GigabitEthernet', '1/0', '37')
+interface_name_pattern = re.compile(r'\b(?P<type>[A-Z][A-Za-z-]*?)(?P<slot>\d+/\d+)/(?P<port>\d+)\b')
 
-    return line
+@lru_cache(maxsize=None)
+def load_interface_translations(path=translation_file):
+    translations = {}
+    try:
+        with open(path, 'r') as csvfile:
+            for row in csv.DictReader(csvfile):
+                table = translations.setdefault(row['pid'].strip(), {})
+                target_slot = row.get('target_slot') or row['slot']
+                port_offset = int(row.get('port_offset') or 0)
+                for port in range(int(row['port_start']), int(row['port_end']) + 1):
+                    table[(row['source_type'], row['slot'], str(port))] = f"{row['target_type']}{target_slot}/{port + port_offset}"
+    except FileNotFoundError:
+        print(f"No interface translation file found at {path}, interface names are kept as they are.")
+    return translations
+
+def get_interface_translations(pid):
+    if not pid:
+        return {}
+    return load_interface_translations().get(pid, {})
+
+'''Translate interface names according to new syntax, every interface name in the line is replaced
+   (interface headers, descriptions and any other reference), names without a translation are kept'''
+def translate_interface_syntax(line, pid=None, translations=None):
+    
+    if translations is None:
+        translations = get_interface_translations(pid)
+    if not translations:
+        return line
+
+    def translate(match):
+        return translations.get((match.group('type'), match.group('slot'), match.group('port')), match.group(0))
+
+    return interface_name_pattern.sub(translate, line)
+
+
+'''Declarative extraction rules, each rule fills one or more template variables from config lines.
+   variables: template variable -> match.expand() template, the expanded value is stripped
+   sections:  where the rule looks, ConfigIndex sections selected by (kind, name):
+                (kind, None)       every section of that kind, e.g. ('hostname', None)
+                (kind, 'prefix*')  the sections of that kind whose name starts with prefix
+                (kind, name)       the one section index.get(kind, name), name may use the {VARIABLE}s
+                                   filled by earlier rules, e.g. the management SVI ('interface', 'Vlan{MGMT_VLAN_ID}')
+                None               the header line of every top level section, no child lines
+              a selected section's header and child lines are read
+   prefixes:  first word of the (left stripped) line that can trigger the rule, None means any line
+   contains:  substrings of which at least one must be in the line before the pattern is tried
+   pattern:   precompiled regex searched in the left stripped line
+   policy:    'last' the last matching line wins, 'first' the first one wins
+   Rules run in table order, a later rule filling the same variable overrides an earlier one.
+   New variables can be extracted by adding a rule here, the extraction loop itself does not change.'''
+ExtractionRule = namedtuple('ExtractionRule', ['variables', 'sections', 'prefixes', 'contains', 'pattern', 'policy'])
+
+EXTRACTION_RULES = [
+    #Sample input: hostname my_oldswitch
+    ExtractionRule({'HOSTNAME': r'\1'}, (('hostname', None),), ('hostname',), (),
+                   re.compile(r'^hostname\s+(\S+)'), 'last'),
+
+    #Sample input: description VLANxx;x;xx;xx;xxxxx;xxxxxx;Management Interface
+    #'vlan' followed by one or more digits gives the Id (14)
+    ExtractionRule({'MGMT_VLAN_ID': r'\1'}, (('interface', 'Vlan*'),), None, ('Management Interface',),
+                   re.compile(r'vlan(\d+)', re.IGNORECASE), 'last'),
+
+    #Sample input: ip tacacs source-interface Vlan14, any top level source-interface line gives the Id as well
+    ExtractionRule({'MGMT_VLAN_ID': r'\1'}, (None,), None, ('source-interface',),
+                   re.compile(r'vlan(\d+)', re.IGNORECASE), 'last'),
+
+    #Sample input: name x-xx_Sw_Mgmt_xx.xxx.xxx.x/xx
+    ExtractionRule({'MGMT_SUBNET': r'\g<subnet>', 'MGMT_SUBNET_MASK_CIDR': r'/\g<mask>'}, (('vlan', None),), None, ('Sw_Mgmt',),
+                   re.compile(r'(?P<subnet>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})/(?P<mask>\d{1,2})'), 'last'),
+
+    #Sample input: ip address xx.xxx.xxx.xx xxx.xxx.xxx.0 of the management SVI, "no ip address" lines don't match the prefix
+    ExtractionRule({'MGMT_SUBNET': r'\g<subnet>'}, (('interface', 'Vlan{MGMT_VLAN_ID}'),), ('ip',), ('ip address',),
+                   re.compile(r'^ip address (?P<ip>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}) (?P<subnet>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'), 'last'),
+
+    #Sample input: ip default-gateway xx.xxx.xxx.x
+    ExtractionRule({'DEFAULT_GATEWAY': r'\1'}, (('ip', None),), ('ip',), ('default-gateway',),
+                   re.compile(r'^ip default-gateway\s+(\S+)'), 'last'),
+
+    #Sample input: snmp-server location xxxxx,xxxxxxx x-x,xxx.xx.xxx, xxxx xxx.xx.xx, xx xx + xx
+    #([^,]+) takes a sequence of characters up to the next comma, repeated for each field
+    ExtractionRule({'CITY': r'\1', 'STREET': r'\2', 'ROOM': r'\3', 'RACK': r'\4'}, (('snmp-server', None),), ('snmp-server',),
+                   ('snmp-server location',), re.compile(r'^snmp-server location ([^,]+),([^,]+),([^,]+),([^,]+)'), 'last'),
+]
+
+#The sections of the index a rule selector picks, values are the variables extracted so far
+def select_sections(index, selector, values):
+    kind, name = selector
+    if name is None:
+        return index.find(kind)
+    if name.endswith('*'):
+        return [section for section in index.find(kind) if section.name.startswith(name[:-1])]
+    try:
+        section = index.get(kind, name.format(**values))
+    except KeyError:
+        #The name needs a variable no earlier rule has filled, e.g. no management VLAN was found
+        return []
+    return [section] if section else []
+
+#The lines a rule reads, in config order per selector
+def rule_lines(index, rule, values):
+    for selector in rule.sections:
+        if selector is None:
+            yield from (section.header for section in index.sections)
+        else:
+            for section in select_sections(index, selector, values):
+                yield from index.iter_lines(section)
+
+'''Runs the rules against a config (ConfigIndex, text or list of lines). Each rule only reads the sections
+   it selects from the index, hostname, SNMP location or the management SVI are dictionary lookups, the only
+   lines read in full are those of the Vlan interfaces and vlans. Returns a new dictionary of the extracted values.'''
+def extract_values(config, rules=EXTRACTION_RULES):
+    index = config if isinstance(config, ConfigIndex) else ConfigIndex(config)
+    values = {}
+
+    for rule in rules:
+        for line in rule_lines(index, rule, values):
+            stripped = line.lstrip()
+            if rule.prefixes is not None and stripped.split(' ', 1)[0] not in rule.prefixes:
+                continue
+            if rule.contains and not any(text in stripped for text in rule.contains):
+                continue
+            match = rule.pattern.search(stripped)
+            if match:
+                for variable, value in rule.variables.items():
+                    values[variable] = match.expand(value).strip()
+                if rule.policy == 'first':
+                    break
+
+    return values
 
 
 '''Extraction function to get corresponding values from each existing switch config, then
-   populates dictionary of templates variables, ready to be used as part of the PnP onboarding process'''
-def get_variables_from_config(all_configs, template):
+   populates dictionary of templates variables, ready to be used as part of the PnP onboarding process.
+   all_configs is either a dict of device id to config or an iterable of (device id, config) pairs,
+   a config is its text, a list of lines or a ConfigIndex. Configs are parsed one at a time as they are
+   consumed and each device's dictionary is yielded as soon as it is complete, nothing holds on to a
+   config after its values are produced. Values come from the EXTRACTION_RULES table.
+   pids optionally maps device id to the new switch pid, used to translate interface names.
+   cluster labels the extraction metrics with the DNA Center cluster the configs came from.'''
+def iter_variables_from_config(all_configs, template, rules=EXTRACTION_RULES, pids=None, cluster=None):
     
-    config_params = []
-    var_values_dict = get_variables_from_template(template)
+    template_vars = get_variables_from_template(template)
     
     '''This dictionary is a last resort in case the existing config that will be
        used to fill the template does not have a value to extract. Please update if
@@ -99,139 +301,104 @@ def get_variables_from_config(all_configs, template):
                              'DEFAULT_GATEWAY': None, 'CITY': None, 'STREET': None, 'ROOM': None, 'RACK': None, 
                              'INTERFACE_CONFIG': []}
 
-    for config in all_configs.values():
-
-        try: 
-
-            var_values_dict["INTERFACE_CONFIG"] = extract_old_interface_config(config)
-
-            for line in config:
-
-                #Searches config for a line that contains hostname at the start then assumes the actual hostname follows in the second portion
-                #Sample input: hostname my_oldswitch
-                #Method: Use .split and take the second item
-
-                if line.startswith('hostname'):
-                    var_values_dict['HOSTNAME'] = line.split()[1]
-
-                #Searches config for a line that contains either of theses strings then gets out MGMT_VLAN_ID via regex
-                #Sample input: description VLANxx;x;xx;xx;xxxxx;xxxxxx;Management Interface
-                #Method: Use r'vlan(\d+)' which looks for 'vlan' followed by one or more digits, match.group(1) gets the Id (14)
-
-                if "Management Interface" in line or "source-interface" in line:
-                    match = re.search(r'vlan(\d+)', line, re.IGNORECASE)
-                    if match:
-                        var_values_dict['MGMT_VLAN_ID'] = match.group(1)
-                
-                #Searches config for a line that contains "Sw_Mgmt", extracts the subnet and mask via regex
-                #Sample input: name x-xx_Sw_Mgmt_xx.xxx.xxx.x/xx
-                #Method: The regex below has two matching groups named subnet and mask, after each one
-                #  there's a regex pattern, the first pattern matches the subnet, the second finds the mask
-
-                if "Sw_Mgmt" in line: 
-                    match = re.search(r"(?P<subnet>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})/(?P<mask>\d{1,2})", line)
-                    if match:
-                        var_values_dict['MGMT_SUBNET'] = match.group('subnet')
-                        var_values_dict['MGMT_SUBNET_MASK_CIDR'] = '/' + match.group('mask')
-                
-                #Searches for "ip address", ignores lines with "no" - won't contain an ip address, uses regex to get info 
-                #Sample input: ip address xx.xxx.xxx.xx xxx.xxx.xxx.0
-                #Method: The regex below is similar to previous, but has groups ip and subnet
-
-                if "ip address" in line and "no" not in line:
-                    match = re.search(r"ip address (?P<ip>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}) (?P<subnet>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})", line)
-                    if match:
-                        var_values_dict['MGMT_SUBNET'] = match.group('subnet')
-                
-                #Simple .split used, sample input would be ip default-gateway xx.xxx.xxx.x
-                if "default-gateway" in line:
-                    var_values_dict['DEFAULT_GATEWAY'] = line.split()[2]
-                
-                #Looks for this string, uses regex to extract info
-                #Sample input: snmp-server location xxxxx,xxxxxxx x-x,xxx.xx.xxx, xxxx xxx.xx.xx, xx xx + xx
-                #Method: the regex pattern ([^,]+) will look for a sequence of characters until it reaches a comma,
-                #   repeats to get required info, .strip() will remove any leading whitespaces
-
-                if "snmp-server location" in line:
-                    match = re.match(r"snmp-server location ([^,]+),([^,]+),([^,]+),([^,]+)", line)
-                    if match:
-                        city, street, room, rack = match.groups()
-                        var_values_dict["CITY"] = city.strip()
-                        var_values_dict["STREET"] = street.strip()
-                        var_values_dict["ROOM"] = room.strip()
-                        var_values_dict["RACK"] = rack.strip()
-            
-        except Exception as e: 
-            print(e)
+    if isinstance(all_configs, dict):
+        all_configs = all_configs.items()
+
+    for device_id, config in all_configs:
+
+        var_values_dict = dict(template_vars)
+        started = time.perf_counter()
+
+        #The config is tokenized into sections once, every extractor works from this index
+        index = config if isinstance(config, ConfigIndex) else ConfigIndex(config)
+        pid = pids.get(device_id) if pids else None
+        var_values_dict["INTERFACE_CONFIG"] = extract_old_interface_config(index, pid)
+        var_values_dict.update(extract_values(index, rules))
+        elapsed = time.perf_counter() - started
+        metrics.registry.record_parse(index.line_count, elapsed)
+        metrics.registry.record_stage('extraction', elapsed, 1, cluster)
+        #Released here, not when the caller asks for the next device
+        index = config = None
 
         #Checks if any keys still don't have a value, if so will use the default values provided earlier
         for key in var_values_dict:
             if var_values_dict[key] is None:
-                var_values_dict[key] = default_values.get(key, None)
-        
-        #Append each device config info to this list
-        config_params.append(var_values_dict)
-    return config_params
+                var_values_dict[key] = copy.copy(default_values.get(key, None))
+
+        yield var_values_dict
+
+#Same as iter_variables_from_config, returns the dictionaries of all devices as a list in config order
+def get_variables_from_config(all_configs, template, rules=EXTRACTION_RULES, pids=None, cluster=None):
+    return list(iter_variables_from_config(all_configs, template, rules, pids, cluster))
 
 '''Uses the config_parameters (populated dictionaries of template variables for all devices)
    along with the name of the template which will be the define onboarding template as defined
-   in your .env file, to merge the mapping csv data to the config_params list for pnp onboarding,
-   fields like serial number and site_name is required for PnP, we merge it here.'''
-def format_list_for_pnp(config_params, template_name):
-    mapping_file = 'config/mapping.csv'
-    pnp_info = copy.deepcopy(config_params)
-
-    with open(mapping_file, 'r') as csvfile:
-        csv_reader = csv.DictReader(csvfile)
-
-        for i, (row, device) in enumerate(zip(csv_reader, pnp_info)):
-            old_hostname = device['HOSTNAME']
-
-            device_info = {
-                'serialNumber': row['new_switch_serial_Cat9k'],
-                'name': old_hostname,
-                'pid': row['pid'],
-                'site_name': row['site_name'],
-                'template_name': template_name
-            }
-            device['HOSTNAME'] = device_info['name']
-            device_info.update(device)
-            pnp_info[i] = device_info
-        return pnp_info
-
-'''This function is used post PnP switch import, the response from executing pnp import
-   is used here to obtain the device Id's, the device Id's will be added to the PnP data
-   to be used when claiming the switches'''
-def extract_new_device_ids(pnp_info, import_info):
-    try:
-        for import_info, device in zip(import_info['successList'], pnp_info):
-            device_id = import_info['id']
-
-            # Insert the device_id after the serialNumber in the dictionary
-            update_device = {}
-            for k, v in device.items():
-                update_device[k] = v
-                if k == "serialNumber":
-                    update_device["device_id"] = device_id
-
-            # Replace the original dictionary with the updated one
-            device.clear()
-            device.update(update_device)
-            
-    except Exception as e:
-        print(e)
+   in your .env file, to merge the mapping data to the config_params list for pnp onboarding,
+   fields like serial number and site_name is required for PnP, we merge it here.
+   mapping_rows holds the MappingRow of each config_params entry (see mapping.load_mapping).'''
+def format_list_for_pnp(config_params, template_name, mapping_rows):
+    pnp_info = []
+
+    for row, device in zip(mapping_rows, copy.deepcopy(config_params)):
+        old_hostname = device['HOSTNAME']
+
+        device_info = {
+            'serialNumber': row.new_serial,
+            'name': old_hostname,
+            'pid': row.pid,
+            'site_name': row.site_name,
+            'template_name': template_name
+        }
+        device['HOSTNAME'] = device_info['name']
+        device_info.update(device)
+        pnp_info.append(device_info)
+    return pnp_info
+
+'''This function is used post PnP switch import, the import results (serial number -> result, see
+   app.import_device_to_pnp) are used here to obtain the device Id's, the device Id's will be added
+   to the PnP data of every imported switch to be used when claiming the switches. Devices are matched
+   by serial number, switches that were not imported are left without a device_id'''
+def extract_new_device_ids(pnp_info, import_results):
+    for device in pnp_info:
+        result = import_results.get(device['serialNumber'])
+        if not result or result['status'] != 'imported':
+            continue
+
+        # Insert the device_id after the serialNumber in the dictionary
+        update_device = {}
+        for k, v in device.items():
+            update_device[k] = v
+            if k == "serialNumber":
+                update_device["device_id"] = result['id']
+
+        # Replace the original dictionary with the updated one
+        device.clear()
+        device.update(update_device)
 
     return pnp_info
 
-#Exporting the finalised PnP data before claiming the newly imported switches'''
-def export_to_output_csv(pnp_info):
+#Columns of the onboarding file that come from DNAC or the mapping file, ahead of the template variables
+onboarding_columns = ['serialNumber', 'device_id', 'name', 'pid', 'site_name', 'template_name']
+
+'''Template variable columns of the onboarding file, known before any row is built: the variables of every
+   template (lists of template lines), then those of the extraction rules and INTERFACE_CONFIG'''
+def variable_columns(templates):
+    variables = []
+    for template in templates:
+        variables += [variable for variable in get_variables_from_template(template) if variable not in variables]
+    for rule in EXTRACTION_RULES:
+        variables += [variable for variable in rule.variables if variable not in variables]
+    if 'INTERFACE_CONFIG' not in variables:
+        variables.append('INTERFACE_CONFIG')
+    return variables
+
+#Exporting the finalised PnP data of every switch once the run has finished (see app.merge_results).
+#pnp_info can be any iterable of rows, they are written as they come, columns not in headers are left out
+def export_to_output_csv(pnp_info, headers):
     onboarding_file = 'config/onboarding.csv' 
-    headers = list(pnp_info[0].keys())
 
     with open(onboarding_file, 'w', newline='', encoding='utf-8') as csvfile:
-        csv_writer = csv.DictWriter(csvfile, fieldnames=headers)
+        csv_writer = csv.DictWriter(csvfile, fieldnames=headers, extrasaction='ignore')
         csv_writer.writeheader()
-
-    with open(onboarding_file, 'a', newline='', encoding='utf-8') as csvfile:
-        csv_writer = csv.DictWriter(csvfile, fieldnames=headers)
-        csv_writer.writerows(pnp_info)  
+        for device in pnp_info:
+            csv_writer.writerow(device)
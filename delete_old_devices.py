@@ -11,69 +11,118 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied. 
 """
 
-import app
-import requests
 import time
+import metrics
+
+#Task poller backoff: first check after initial_poll_delay seconds, then doubling up to max_poll_delay,
+#a task still running after task_timeout seconds is reported as timed out
+initial_poll_delay = 1
+max_poll_delay = 30
+task_timeout = 900
 
 '''
 Request Details for Task
 '''
-def getTask(token, task_id):
-    
-    url = f"{app.base_url}/task/{task_id}"
-    
-    headers = {
-        "x-auth-token": token,
-        "Content-Type": "application/json",
-        }
+def getTask(client, task_id):
 
-    task = requests.get(url, headers=headers, verify=False).json()
+    task = client.get(f"/task/{task_id}").json()['response']
 
-    task_status = task['response']['progress']
-    task_error = task['response']['isError']
+    print(f"Task Status: {task.get('progress')}, Task Error: {task.get('isError')}")
 
-    print(f"Task Status: {task_status}, Task Error: {task_error}")
+    return task
 
-    return task_status, task_error 
+#A task is done once it reports an error or DNAC has set its end time, whatever its progress text says
+def task_finished(task):
+    return bool(task.get('isError')) or task.get('endTime') is not None
 
 '''
 Delete old device from the inventory, without changing the config on the switch
 '''
-def delete_device(id, token):
-    
-    url = f"{app.base_url}/network-device/{id}?cleanConfig=false"
-
-    payload = None
-
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        'x-auth-token': token
-    }
+def delete_device(client, id):
 
-    response = requests.request('DELETE', url, headers=headers, data = payload, verify=False)
+    response = client.delete(f"/network-device/{id}?cleanConfig=false")
 
     return(response.json())
 
 '''
-Delete all old switches from the inventory
+Polls all outstanding tasks together, tasks maps task id to device. Every task has its own
+backoff, only the tasks that are due are checked (concurrently) and each device is reported
+as soon as its task finishes. Returns device id -> {'status', 'reason', 'task_id'}
 '''
-def delete_old_switch(token, existing_devices):
-    
-    for device in existing_devices:
-        
-        print(f"Deleting old device: {device['serialNumber']}")
-        
-        response = delete_device(device['id'], token)
-        task_id = response["response"]["taskId"]
-        
-        task_status, task_error  = getTask(token, task_id)
-
-        while task_status.startswith('Deleting device') and not task_error:
-            time.sleep(10)
-            task_status, task_error = getTask(token, task_id)
-
+def wait_for_tasks(client, tasks):
+    results = {}
+    started = time.monotonic()
+    #task id -> (next check time, current delay)
+    schedule = {task_id: (started + initial_poll_delay, initial_poll_delay) for task_id in tasks}
+
+    def poll(task_id):
+        try:
+            return getTask(client, task_id)
+        except Exception as e:
+            print(f"Task {task_id} could not be checked, retrying: {e}")
+            return None
+
+    while schedule:
+        now = time.monotonic()
+        due = [task_id for task_id, (next_check, _) in schedule.items() if next_check <= now]
+        if not due:
+            time.sleep(min(next_check for next_check, _ in schedule.values()) - now)
+            continue
+
+        for task_id, task in zip(due, client.map_concurrent(poll, due)):
+            device = tasks[task_id]
+            device_id, serial = device['id'], device['serialNumber']
+
+            if task is not None and task_finished(task):
+                del schedule[task_id]
+                if task.get('isError'):
+                    results[device_id] = {'status': 'failed', 'reason': task.get('failureReason') or task.get('progress'),
+                                          'task_id': task_id}
+                else:
+                    results[device_id] = {'status': 'deleted', 'reason': None, 'task_id': task_id}
+                print(f"Old device {serial}: {results[device_id]['status']}")
+
+            elif time.monotonic() - started > task_timeout:
+                del schedule[task_id]
+                results[device_id] = {'status': 'timeout', 'reason': f"task {task_id} still running after {task_timeout}s",
+                                      'task_id': task_id}
+                print(f"Old device {serial}: timeout")
+
+            else:
+                delay = min(schedule[task_id][1] * 2, max_poll_delay)
+                schedule[task_id] = (time.monotonic() + delay, delay)
+
+    return results
 
+'''
+Delete all old switches from the inventory, deletions are issued concurrently on the shared client
+and one poller then waits for all deletion tasks together. Every inventory device is deleted once,
+even when several mapping rows are members of the same stack. running_tasks maps device id to the task id
+of a deletion an earlier run gave up waiting for (timeout), that task is polled again instead of deleting
+the device a second time, DNAC may well have finished it since. Returns device id -> {'status', 'reason', 'task_id'}
+'''
+def delete_old_switch(client, existing_devices, running_tasks=None):
 
-   
+    running_tasks = running_tasks or {}
+    existing_devices = list({device['id']: device for device in existing_devices}.values())
 
+    def start_delete(device):
+        print(f"Deleting old device: {device['serialNumber']}")
+        try:
+            return delete_device(client, device['id'])["response"]["taskId"]
+        except Exception as e:
+            print(f"Deleting old device {device['serialNumber']} failed: {e}")
+            return e
+
+    tasks = {running_tasks[device['id']]: device for device in existing_devices if device['id'] in running_tasks}
+    results = {}
+    to_delete = [device for device in existing_devices if device['id'] not in running_tasks]
+    for device, task_id in zip(to_delete, client.map_concurrent(start_delete, to_delete)):
+        if isinstance(task_id, Exception):
+            results[device['id']] = {'status': 'failed', 'reason': str(task_id)}
+        else:
+            tasks[task_id] = device
+
+    with metrics.registry.stage('deletion_wait', items=len(tasks), cluster=client.cluster):
+        results.update(wait_for_tasks(client, tasks))
+    return results
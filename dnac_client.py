@@ -0,0 +1,236 @@
+""" Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+           https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import requests, urllib3, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+import metrics
+
+urllib3.disable_warnings()
+
+'''Raised when DNAC answers with an error status that retrying could not resolve'''
+class DNACError(Exception):
+
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        super().__init__(f"{response.request.method} {response.url} failed with {response.status_code}: {response.text[:500]}")
+
+
+'''Token bucket rate limiter shared between threads, acquire() blocks until a call may be made.
+   rate is the number of calls per second, burst how many calls may go out back to back.
+   With max_rate set the bucket is adaptive: slow_down() halves the rate (and pauses every caller
+   for Retry-After seconds if given), speed_up() raises it again step by step up to max_rate.
+   The rate is halved once per throttle event, not once per throttled call: calls that were already
+   in flight when the rate was last lowered only extend the pause.'''
+class TokenBucket:
+
+    def __init__(self, rate, burst=1, max_rate=None, min_rate=0.2):
+        self.rate = rate
+        self.burst = burst
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.slowed_at = float('-inf')
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    #sent_at is the time.monotonic() the throttled call was sent, without it the call counts as sent one interval ago
+    def slow_down(self, retry_after=None, sent_at=None):
+        with self.lock:
+            now = time.monotonic()
+            if sent_at is None:
+                sent_at = now - 1 / self.rate
+            if sent_at >= self.slowed_at:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.tokens = 0
+                self.slowed_at = now
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                self.updated = self.paused_until
+
+    def speed_up(self):
+        if self.max_rate is None or self.rate >= self.max_rate:
+            return
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+#Retry-After is either a number of seconds or an HTTP date
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+'''Shared DNAC API client used by every stage of the migration. It keeps a single
+   keep-alive connection pool to DNAC so TLS handshakes are only paid once per pooled
+   connection, and offers a bounded concurrent mode so independent per-device calls
+   overlap instead of running back to back. max_workers caps the requests in flight across the whole
+   client, however many stages, waves and nested map_concurrent calls are running at once.
+   Every call goes through an adaptive token bucket starting at api_rate calls per second, which
+   backs off on 429 (honouring Retry-After) and recovers on success. An expired token (401) is
+   refreshed once and the call replayed, so long runs survive token expiry.'''
+class DNACClient:
+
+    #Statuses that mean DNAC wants us to slow down, and how often one call is retried on them
+    throttle_statuses = (429, 503)
+    max_retries = 5
+
+    def __init__(self, host, username, password, max_workers=8, verify=False, api_rate=10, cluster=None):
+        self.host = host
+        #Name of the DNA Center cluster, labels the metrics of this client's calls
+        self.cluster = cluster
+        #host is normally a name or address, a full http(s):// url is accepted for local stand-ins
+        self.root_url = host if host.startswith(("https://", "http://")) else f"https://{host}"
+        self.base_url = f"{self.root_url}/dna/intent/api/v1"
+        self.username = username
+        self.password = password
+        self.max_workers = max_workers
+        self.verify = verify
+        self.token = None
+        self.auth_lock = threading.Lock()
+        self.throttle = TokenBucket(api_rate, burst=max_workers, max_rate=api_rate)
+        #Held for the duration of every HTTP call, so never more calls are in flight than pooled connections
+        self.in_flight = threading.BoundedSemaphore(max_workers)
+        #Every call is recorded here (endpoint, status, latency, retries, bytes)
+        self.metrics = metrics.registry
+        #Optional ResolverCache shared by the stages for name -> id lookups
+        self.resolver = None
+
+        #One pooled connection per worker, so no worker ever waits on a fresh handshake
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            'content-type': "application/json",
+            'Accept': "application/json"
+        })
+
+    #Requests a token which is attached to every following call made with this client
+    def auth(self):
+        url = f"{self.root_url}/api/system/v1/auth/token"
+        resp = self.session.post(url=url, auth=requests.auth.HTTPBasicAuth(self.username, self.password), verify=self.verify)
+        if not resp.ok:
+            raise DNACError(resp)
+        self.token = resp.json()["Token"]
+        return self.token
+
+    #Only the first thread that sees a 401 for a given token fetches a new one, the others reuse it
+    def refresh_token(self, stale_token):
+        with self.auth_lock:
+            if self.token == stale_token:
+                print("DNAC token expired, requesting a new one.")
+                self.auth()
+
+    #Paths are relative to the v1 intent API unless a full url is given (e.g. for v2 endpoints)
+    def url(self, path):
+        if path.startswith(("https://", "http://")):
+            return path
+        return self.base_url + path
+
+    '''Sends one call through the throttle, handling 401 (refresh and replay once) and 429/503
+       (slow down and retry). Raises DNACError for any other error status unless check is False.'''
+    def request(self, method, path, check=True, **kwargs):
+        kwargs.setdefault('verify', self.verify)
+        refreshed = False
+        started = time.perf_counter()
+
+        for attempt in range(self.max_retries + 1):
+            self.throttle.acquire()
+            token = self.token
+            headers = dict(kwargs.pop('headers', None) or {})
+            headers['x-auth-token'] = token or ""
+            with self.in_flight:
+                sent_at = time.monotonic()
+                resp = self.session.request(method, self.url(path), headers=headers, **kwargs)
+            kwargs['headers'] = headers
+
+            if resp.status_code == 401 and not refreshed:
+                refreshed = True
+                self.refresh_token(token)
+                continue
+
+            if resp.status_code in self.throttle_statuses and attempt < self.max_retries:
+                retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                print(f"DNAC throttled {method} {path} ({resp.status_code}), retrying after {retry_after or 'backoff'}.")
+                self.throttle.slow_down(retry_after or 2 ** attempt, sent_at)
+                continue
+
+            break
+
+        self.metrics.record_call(method, path, resp.status_code, time.perf_counter() - started, len(resp.content), attempt,
+                                 self.cluster)
+        if resp.ok:
+            self.throttle.speed_up()
+        elif check:
+            raise DNACError(resp)
+        return resp
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    '''Runs func once per item on up to max_workers threads (calls in flight are capped by request), results are
+       returned in the same order as the items so they can still be lined up with the input'''
+    def map_concurrent(self, func, items, max_workers=None):
+        items = list(items)
+        if not items:
+            return []
+        workers = min(max_workers or self.max_workers, len(items))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(func, items))
+
+    '''Streaming version of map_concurrent, results are yielded in item order as soon as they
+       are ready. At most max_workers items are in flight or waiting to be consumed, so memory
+       stays bounded by the worker count rather than by the number of items.'''
+    def imap(self, func, items, max_workers=None):
+        workers = max_workers or self.max_workers
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
@@ -0,0 +1,97 @@
+""" Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+           https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import csv
+from collections import namedtuple
+
+#Mapping file column -> MappingRow field, image_version and cluster are optional columns
+columns = {
+    'old_switch_serial': 'old_serial',
+    'new_switch_serial_Cat9k': 'new_serial',
+    'pid': 'pid',
+    'site_name': 'site_name',
+    'image_version': 'image_version',
+    'cluster': 'cluster',
+}
+required_columns = ['old_switch_serial', 'new_switch_serial_Cat9k', 'pid', 'site_name']
+
+'''One switch of the mapping file, image_version is None when the cell is empty (keep the current image),
+   cluster is None when the cell is empty (routed by site, see clusters.route),
+   line is the line number in the mapping file for error messages'''
+MappingRow = namedtuple('MappingRow', list(columns.values()) + ['line'])
+
+
+class MappingError(ValueError):
+    pass
+
+
+'''The mapping file, loaded and validated once and shared by every stage. Rows keep the file order
+   and are indexed by old and by new serial, so stages match devices by serial, never by position.'''
+class Mapping:
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.by_old_serial = {row.old_serial: row for row in rows}
+        self.by_new_serial = {row.new_serial: row for row in rows}
+
+    def old_serials(self):
+        return [row.old_serial for row in self.rows]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, old_serial):
+        return self.by_old_serial[old_serial]
+
+
+'''Reads the mapping file with the csv module and validates it: all required columns present, no
+   unknown columns, no empty required cells and no serial used twice. Every problem found is
+   reported together in one MappingError.'''
+def load_mapping(path):
+    problems = []
+    rows = []
+
+    with open(path, 'r', newline='', encoding='utf-8-sig') as csvfile:
+        reader = csv.DictReader(csvfile)
+        header = [name.strip() for name in reader.fieldnames or []]
+        reader.fieldnames = header
+
+        unknown = [name for name in header if name not in columns]
+        missing = [name for name in required_columns if name not in header]
+        if unknown:
+            problems.append(f"unknown columns {unknown}, expected {list(columns)}")
+        if missing:
+            raise MappingError(f"{path}: missing columns {missing}")
+
+        seen_old, seen_new = {}, {}
+        for line, record in enumerate(reader, 2):
+            values = {field: (record.get(column) or '').strip() for column, field in columns.items()}
+            if not any(values.values()):
+                continue
+
+            for column in required_columns:
+                if not values[columns[column]]:
+                    problems.append(f"line {line}: empty {column}")
+            for serial, seen, column in ((values['old_serial'], seen_old, 'old_switch_serial'),
+                                         (values['new_serial'], seen_new, 'new_switch_serial_Cat9k')):
+                if serial and serial in seen:
+                    problems.append(f"line {line}: {column} {serial} already used on line {seen[serial]}")
+                seen.setdefault(serial, line)
+
+            values['image_version'] = values['image_version'] or None
+            values['cluster'] = values['cluster'] or None
+            rows.append(MappingRow(line=line, **values))
+
+    if problems:
+        raise MappingError(f"{path}: " + "; ".join(problems))
+    return Mapping(rows)
@@ -0,0 +1,174 @@
+""" Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+           https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import json, os, re, threading, time
+from contextlib import contextmanager
+
+#Upper bounds (seconds) of the timing histogram buckets
+buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, float('inf'))
+
+#Ids in API paths are replaced so calls are grouped per endpoint, e.g. /network-device/{id}/config
+id_pattern = re.compile(r'/(?:[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|[0-9a-fA-F]{24,}|\d+)(?=/|$)')
+
+def endpoint_template(path):
+    path = path.split('?', 1)[0]
+    path = re.sub(r'^https?://[^/]+', '', path)
+    path = re.sub(r'^/dna/intent/api/(v\d+)', lambda match: '' if match.group(1) == 'v1' else f"/{match.group(1)}", path)
+    return id_pattern.sub('/{id}', path)
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    #Cumulative counts per bucket bound, as Prometheus expects them
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(buckets, self.counts):
+            total += count
+            yield bound, total
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': round(self.sum, 6),
+                'buckets': {('+Inf' if bound == float('inf') else str(bound)): count for bound, count in self.cumulative()}}
+
+
+'''Performance metrics of a run: every DNAC API call (endpoint, status, latency, retries, response bytes),
+   every pipeline stage (items and timings) and the config parser throughput (lines per second).
+   The module level registry is shared by the client, the stages and config_transfer, it can be exported
+   as JSON or as a Prometheus textfile (for the node exporter textfile collector). API calls and stages are
+   labelled with the DNA Center cluster they ran against, 'default' for a single cluster.'''
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.api_calls = {}
+        self.stages = {}
+        self.parser = {'configs': 0, 'lines': 0, 'seconds': 0.0}
+
+    def record_call(self, method, path, status, seconds, response_bytes=0, retries=0, cluster=None):
+        key = (cluster or 'default', method, endpoint_template(path), str(status))
+        with self.lock:
+            call = self.api_calls.get(key)
+            if call is None:
+                call = self.api_calls[key] = {'count': 0, 'retries': 0, 'bytes': 0, 'latency': Histogram()}
+            call['count'] += 1
+            call['retries'] += retries
+            call['bytes'] += response_bytes
+            call['latency'].observe(seconds)
+
+    def record_stage(self, name, seconds, items=0, cluster=None):
+        key = (cluster or 'default', name)
+        with self.lock:
+            stage = self.stages.get(key)
+            if stage is None:
+                stage = self.stages[key] = {'runs': 0, 'items': 0, 'duration': Histogram()}
+            stage['runs'] += 1
+            stage['items'] += items
+            stage['duration'].observe(seconds)
+
+    #with registry.stage('claim', items=len(claims)): ... records the duration of the block
+    @contextmanager
+    def stage(self, name, items=0, cluster=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.perf_counter() - started, items, cluster)
+
+    def record_parse(self, lines, seconds):
+        with self.lock:
+            self.parser['configs'] += 1
+            self.parser['lines'] += lines
+            self.parser['seconds'] += seconds
+
+    def to_dict(self):
+        with self.lock:
+            parser = dict(self.parser)
+            parser['lines_per_second'] = round(parser['lines'] / parser['seconds'], 1) if parser['seconds'] else None
+            return {
+                'started': self.started,
+                'elapsed_seconds': round(time.time() - self.started, 3),
+                'api_calls': [{'cluster': cluster, 'method': method, 'endpoint': endpoint, 'status': status, 'count': call['count'],
+                               'retries': call['retries'], 'bytes': call['bytes'], 'latency': call['latency'].to_dict()}
+                              for (cluster, method, endpoint, status), call in sorted(self.api_calls.items())],
+                'stages': [{'cluster': cluster, 'stage': name, 'runs': stage['runs'], 'items': stage['items'],
+                            'duration': stage['duration'].to_dict()}
+                           for (cluster, name), stage in sorted(self.stages.items())],
+                'parser': parser,
+            }
+
+    def write_json(self, path):
+        with open(path, 'w') as metrics_file:
+            json.dump(self.to_dict(), metrics_file, indent=2)
+
+    def prometheus_lines(self):
+        data = self.to_dict()
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"])
+
+        def histogram(name, labels, values):
+            for bound, count in values['buckets'].items():
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f"{name}_sum{{{labels}}} {values['sum']}")
+            lines.append(f"{name}_count{{{labels}}} {values['count']}")
+
+        call_labels = lambda call: (f'cluster="{call["cluster"]}",method="{call["method"]}",endpoint="{call["endpoint"]}",'
+                                    f'status="{call["status"]}"')
+        stage_labels = lambda stage: f'cluster="{stage["cluster"]}",stage="{stage["stage"]}"'
+        metric('dnac_api_calls_total', 'counter', "DNAC API calls by endpoint and status.")
+        lines += [f"dnac_api_calls_total{{{call_labels(call)}}} {call['count']}" for call in data['api_calls']]
+        metric('dnac_api_retries_total', 'counter', "Retries (throttling, token refresh) of DNAC API calls.")
+        lines += [f"dnac_api_retries_total{{{call_labels(call)}}} {call['retries']}" for call in data['api_calls']]
+        metric('dnac_api_response_bytes_total', 'counter', "Response bytes received from DNAC.")
+        lines += [f"dnac_api_response_bytes_total{{{call_labels(call)}}} {call['bytes']}" for call in data['api_calls']]
+        metric('dnac_api_call_duration_seconds', 'histogram', "Latency of DNAC API calls including retries.")
+        for call in data['api_calls']:
+            histogram('dnac_api_call_duration_seconds', call_labels(call), call['latency'])
+
+        metric('migration_stage_items_total', 'counter', "Devices processed per pipeline stage.")
+        lines += [f"migration_stage_items_total{{{stage_labels(stage)}}} {stage['items']}" for stage in data['stages']]
+        metric('migration_stage_duration_seconds', 'histogram', "Wall time of pipeline stage runs.")
+        for stage in data['stages']:
+            histogram('migration_stage_duration_seconds', stage_labels(stage), stage['duration'])
+
+        metric('config_parser_lines_total', 'counter', "Running config lines parsed.")
+        lines.append(f"config_parser_lines_total {data['parser']['lines']}")
+        metric('config_parser_seconds_total', 'counter', "Time spent parsing running configs.")
+        lines.append(f"config_parser_seconds_total {round(data['parser']['seconds'], 6)}")
+        metric('config_parser_lines_per_second', 'gauge', "Parser throughput over the run.")
+        lines.append(f"config_parser_lines_per_second {data['parser']['lines_per_second'] or 0}")
+        return lines
+
+    #Written to a temporary file first, the textfile collector must never read half a file
+    def write_prometheus(self, path):
+        with open(path + '.tmp', 'w') as metrics_file:
+            metrics_file.write("\n".join(self.prometheus_lines()) + "\n")
+        os.replace(path + '.tmp', path)
+
+
+registry = Metrics()
@@ -0,0 +1,323 @@
+""" Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+           https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import argparse, json, random, re, ssl, threading, time, uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+'''Local stand-in for DNA Center covering the endpoints this project uses, for measuring and regression
+   testing the migration without a live DNAC. Every endpoint can be given a latency (seconds) and an error
+   rate (fraction of calls answered with 500, or 429 with Retry-After for "throttle"), devices get synthetic
+   Catalyst 3k running configs. Endpoint names used for latency, errors and call counts:
+   auth, device_lookup, device_config, template, site, image, device_delete, task, pnp_lookup, pnp_import, site_claim
+   GET /mock/calls returns the number of calls per endpoint so far.'''
+
+routes = [
+    ('POST', r'^/api/system/v1/auth/token$', 'auth'),
+    ('GET', r'^/dna/intent/api/v1/network-device$', 'device_lookup'),
+    ('GET', r'^/dna/intent/api/v1/network-device/(?P<id>[^/]+)/config$', 'device_config'),
+    ('DELETE', r'^/dna/intent/api/v1/network-device/(?P<id>[^/]+)$', 'device_delete'),
+    ('GET', r'^/dna/intent/api/v1/task/(?P<id>[^/]+)$', 'task'),
+    ('GET', r'^/dna/intent/api/v2/template-programmer/template$', 'template'),
+    ('GET', r'^/dna/intent/api/v1/site$', 'site'),
+    ('GET', r'^/dna/intent/api/v1/image/importation$', 'image'),
+    ('GET', r'^/dna/intent/api/v1/onboarding/pnp-device$', 'pnp_lookup'),
+    ('POST', r'^/dna/intent/api/v1/onboarding/pnp-device/import$', 'pnp_import'),
+    ('POST', r'^/dna/intent/api/v1/onboarding/pnp-device/site-claim$', 'site_claim'),
+]
+compiled_routes = [(method, re.compile(pattern), name) for method, pattern, name in routes]
+
+template_content = """hostname {{ HOSTNAME }}
+!
+ip default-gateway {{ DEFAULT_GATEWAY }}
+snmp-server location {{ CITY }},{{ STREET }},{{ ROOM }},{{ RACK }}
+!
+{% for line in INTERFACE_CONFIG %}
+{{line}}
+{% endfor %}"""
+
+#Synthetic running config of a Catalyst 3650 (stack), roughly 10 lines per access port
+def synthetic_config(index, members=1):
+    vlan_id = 10 + index % 50
+    lines = ["Building configuration...", "", "Current configuration : 24812 bytes", "!", "version 16.12",
+             "service timestamps debug datetime msec", "!", f"hostname OLD-SW-{index:05d}", "!",
+             "vlan internal allocation policy ascending", "!",
+             f"vlan {vlan_id}", f" name x-zz_Sw_Mgmt_10.{index // 250 % 250}.{index % 250}.0/24", "!",
+             "vlan 100", " name users", "!", "vlan 200", " name voice", "!"]
+    for member in range(1, members + 1):
+        for port in range(1, 49):
+            lines += [f"interface GigabitEthernet{member}/0/{port}",
+                      f" description access port {member}/{port}",
+                      " switchport access vlan 100",
+                      " switchport mode access",
+                      " switchport voice vlan 200",
+                      " spanning-tree portfast",
+                      " spanning-tree bpduguard enable",
+                      " authentication port-control auto",
+                      " mab",
+                      " dot1x pae authenticator", "!"]
+        for port in range(1, 5):
+            lines += [f"interface TenGigabitEthernet{member}/1/{port}", " switchport mode trunk",
+                      " channel-group 1 mode active", "!"]
+    lines += ["interface Port-channel1", " switchport mode trunk", "!",
+              f"interface Vlan{vlan_id}", f" description VLAN{vlan_id};a;b;Management Interface",
+              f" ip address 10.{index // 250 % 250}.{index % 250}.5 255.255.255.0", "!",
+              f"ip default-gateway 10.{index // 250 % 250}.{index % 250}.1",
+              f"ip tacacs source-interface Vlan{vlan_id}",
+              f"snmp-server location Zurich, Main Street {index}, Room {index % 20}, Rack {index % 8}",
+              "!", "lldp run", "!", "end"]
+    return "\n".join(lines)
+
+
+class MockDNAC:
+
+    def __init__(self, devices=10, latency=None, errors=None, stack_members=1, task_duration=2.0,
+                 token_lifetime=None, sites=('Global/Zurich/Zurich1',), images=('cat9k_iosxe.17.09.04a.SPA.bin',)):
+        self.latency = latency or {}
+        self.errors = errors or {}
+        self.stack_members = stack_members
+        self.task_duration = task_duration
+        self.token_lifetime = token_lifetime
+        self.tokens = {}
+        self.tasks = {}
+        self.pnp_devices = {}
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.devices_by_serial = {}
+        for i in range(devices):
+            self.add_device(i)
+        self.sites = {name: str(uuid.uuid4()) for name in sites}
+        self.images = {name: str(uuid.uuid4()) for name in images}
+        self.server = None
+
+    def add_device(self, index):
+        device = {'id': str(uuid.uuid4()), 'serialNumber': f"OLD{index:07d}", 'hostname': f"OLD-SW-{index:05d}",
+                  'platformId': 'WS-C3650-48PD', 'lastUpdateTime': 1690000000000 + index, 'index': index}
+        self.devices[device['id']] = device
+        self.devices_by_serial[device['serialNumber']] = device
+        return device
+
+    #Old and new serial of every device, ready to be written as a mapping file
+    def mapping_rows(self, pid='C9300-48UB', image=''):
+        site = next(iter(self.sites))
+        return [{'old_switch_serial': device['serialNumber'], 'new_switch_serial_Cat9k': f"NEW{device['index']:07d}",
+                 'pid': pid, 'site_name': site, 'image_version': image} for device in self.devices.values()]
+
+    def start(self, host='127.0.0.1', port=0, certfile=None, keyfile=None):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                mock.handle(self, 'GET')
+
+            def do_POST(self):
+                mock.handle(self, 'POST')
+
+            def do_DELETE(self):
+                mock.handle(self, 'DELETE')
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        scheme = 'http'
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+            scheme = 'https'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"{scheme}://{host}:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def handle(self, request, method):
+        url = urlparse(request.path)
+        query = parse_qs(url.query)
+        length = int(request.headers.get('Content-Length') or 0)
+        body = json.loads(request.rfile.read(length) or 'null') if length else None
+
+        #Call counters for benchmarks, not part of the DNAC API
+        if url.path == '/mock/calls':
+            with self.lock:
+                return self.reply(request, 200, dict(self.calls))
+
+        for route_method, pattern, name in compiled_routes:
+            match = pattern.match(url.path)
+            if match and route_method == method:
+                break
+        else:
+            return self.reply(request, 404, {'response': {'message': f"no mock for {method} {url.path}"}})
+
+        with self.lock:
+            self.calls[name] += 1
+        time.sleep(self.latency.get(name, self.latency.get('default', 0)))
+
+        error = self.errors.get(name)
+        if error and random.random() < error[1]:
+            if error[0] == 'throttle':
+                return self.reply(request, 429, {'response': {'message': 'rate limited'}}, {'Retry-After': '1'})
+            return self.reply(request, 500, {'response': {'message': 'injected error'}})
+
+        if name != 'auth' and not self.token_valid(request.headers.get('x-auth-token')):
+            return self.reply(request, 401, {'response': {'message': 'token expired'}})
+
+        status, payload = getattr(self, 'on_' + name)(match, query, body)
+        self.reply(request, status, payload)
+
+    def reply(self, request, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            request.send_header(key, value)
+        request.end_headers()
+        request.wfile.write(data)
+
+    def token_valid(self, token):
+        issued = self.tokens.get(token)
+        if issued is None:
+            return False
+        return self.token_lifetime is None or time.time() - issued < self.token_lifetime
+
+    def on_auth(self, match, query, body):
+        token = str(uuid.uuid4())
+        self.tokens[token] = time.time()
+        return 200, {'Token': token}
+
+    def on_device_lookup(self, match, query, body):
+        devices = [self.devices_by_serial[serial] for serial in query.get('serialNumber', []) if serial in self.devices_by_serial]
+        offset = int(query.get('offset', ['1'])[0])
+        limit = int(query.get('limit', ['500'])[0])
+        page = devices[offset - 1:offset - 1 + limit]
+        return 200, {'response': [{k: v for k, v in device.items() if k != 'index'} for device in page]}
+
+    def on_device_config(self, match, query, body):
+        device = self.devices.get(match.group('id'))
+        if device is None:
+            return 404, {'response': {'message': 'device not found'}}
+        return 200, {'response': synthetic_config(device['index'], self.stack_members)}
+
+    def on_device_delete(self, match, query, body):
+        with self.lock:
+            device = self.devices.pop(match.group('id'), None)
+            if device:
+                self.devices_by_serial.pop(device['serialNumber'], None)
+        task_id = str(uuid.uuid4())
+        self.tasks[task_id] = (time.time(), device is None)
+        return 202, {'response': {'taskId': task_id, 'url': f"/api/v1/task/{task_id}"}}
+
+    def on_task(self, match, query, body):
+        started, failed = self.tasks[match.group('id')]
+        task = {'id': match.group('id'), 'startTime': int(started * 1000), 'isError': False,
+                'progress': 'Deleting device'}
+        if time.time() - started >= self.task_duration:
+            task.update({'endTime': int(time.time() * 1000), 'progress': 'Network device deleted successfully'})
+            if failed:
+                task.update({'isError': True, 'failureReason': 'Device not found', 'progress': 'Deletion failed'})
+        return 200, {'response': task}
+
+    def on_template(self, match, query, body):
+        name = query.get('name', [''])[0]
+        return 200, {'response': [{'id': 'template-1', 'name': name, 'version': '1', 'templateContent': template_content}]}
+
+    def on_site(self, match, query, body):
+        if 'name' not in query:
+            offset, limit = int(query.get('offset', ['1'])[0]), int(query.get('limit', ['500'])[0])
+            sites = [{'id': site_id, 'siteNameHierarchy': name} for name, site_id in self.sites.items()]
+            return 200, {'response': sites[offset - 1:offset - 1 + limit]}
+        name = query.get('name', [''])[0]
+        if name not in self.sites:
+            return 404, {'response': {'message': f"site {name} not found"}}
+        return 200, {'response': [{'id': self.sites[name], 'siteNameHierarchy': name}]}
+
+    def on_image(self, match, query, body):
+        names = query.get('imageName')
+        images = [{'imageUuid': uuid_, 'name': name} for name, uuid_ in self.images.items() if not names or name in names]
+        offset, limit = int(query.get('offset', ['1'])[0]), int(query.get('limit', ['500'])[0])
+        return 200, {'response': images[offset - 1:offset - 1 + limit]}
+
+    def on_pnp_lookup(self, match, query, body):
+        serials = query.get('serialNumber', [])
+        return 200, [device for serial, device in self.pnp_devices.items() if serial in serials]
+
+    def on_pnp_import(self, match, query, body):
+        success, failure = [], []
+        for item in body:
+            serial = item['deviceInfo']['serialNumber']
+            with self.lock:
+                if serial in self.pnp_devices:
+                    failure.append({'index': len(success) + len(failure), 'serialNum': serial, 'id': None,
+                                    'msg': 'Device already exists'})
+                    continue
+                device = {'id': str(uuid.uuid4()), 'deviceInfo': dict(item['deviceInfo'], state='Unclaimed')}
+                self.pnp_devices[serial] = device
+            success.append(device)
+        return 200, {'successList': success, 'failureList': failure}
+
+    def on_site_claim(self, match, query, body):
+        if body.get('siteId') not in self.sites.values():
+            return 400, {'response': {'message': 'invalid site id'}}
+        return 200, {'response': 'Device Claimed', 'version': '1.0'}
+
+
+#Latency and error options are given as endpoint=value, e.g. --latency device_config=0.2 --error task=throttle:0.1
+def parse_endpoint_options(values, convert):
+    options = {}
+    for value in values or []:
+        name, _, setting = value.partition('=')
+        options[name] = convert(setting)
+    return options
+
+def parse_error(setting):
+    kind, _, rate = setting.partition(':')
+    return kind, float(rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local DNA Center stand-in for testing and benchmarking.")
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--stack-members', type=int, default=1)
+    parser.add_argument('--task-duration', type=float, default=2.0, help="Seconds until a deletion task finishes")
+    parser.add_argument('--token-lifetime', type=float, help="Seconds until a token expires (401)")
+    parser.add_argument('--latency', action='append', help="endpoint=seconds, 'default' applies to every endpoint")
+    parser.add_argument('--error', action='append', help="endpoint=error:rate or endpoint=throttle:rate")
+    parser.add_argument('--certfile', help="Serve HTTPS with this certificate (and --keyfile)")
+    parser.add_argument('--keyfile')
+    parser.add_argument('--mapping', help="Write a mapping file for the generated devices to this path")
+    args = parser.parse_args()
+
+    mock = MockDNAC(devices=args.devices, stack_members=args.stack_members, task_duration=args.task_duration,
+                    token_lifetime=args.token_lifetime,
+                    latency=parse_endpoint_options(args.latency, float), errors=parse_endpoint_options(args.error, parse_error))
+    if args.mapping:
+        import csv
+        with open(args.mapping, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=list(mock.mapping_rows()[0].keys()))
+            writer.writeheader()
+            writer.writerows(mock.mapping_rows())
+    print(f"Mock DNAC listening on {mock.start(port=args.port, certfile=args.certfile, keyfile=args.keyfile)}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        mock.stop()
@@ -0,0 +1,118 @@
+""" Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+           https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import argparse, csv, glob, json, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+import config_transfer
+
+'''Offline batch extraction over archived running configs, no DNAC needed. Every config file in a directory
+   goes through the same template variable extraction and interface config selection as a live run,
+   spread over a process pool. Results are streamed to a CSV (same columns as config/onboarding.csv plus
+   config_file) or JSONL file in chunks, and every file with template variables that could not be
+   extracted is reported. Example:
+       python3 offline_extract.py archive/ example_template.txt --output audit.csv --pid C9300-48UXM'''
+
+#Columns of config/onboarding.csv that come from DNAC or the mapping file, empty in an offline audit
+onboarding_columns = config_transfer.onboarding_columns
+
+#Set once per worker process by init_worker, so the template is not sent along with every file
+worker_template = None
+worker_pid = None
+
+def init_worker(template_list, pid):
+    global worker_template, worker_pid
+    worker_template = template_list
+    worker_pid = pid
+
+#Runs in a worker: extracts one config file, returns (path, values, missing variables, line count)
+def extract_file(path):
+    with open(path, 'r', encoding='utf-8', errors='replace') as config_file:
+        config = config_transfer.ConfigIndex(config_file.read())
+    params = config_transfer.get_variables_from_config([(path, config)], worker_template, pids={path: worker_pid})[0]
+    missing = sorted(key for key, value in params.items() if value is None or value == [])
+    return path, params, missing, config.line_count
+
+
+def output_columns(template_list):
+    return onboarding_columns + config_transfer.variable_columns([template_list]) + ['config_file']
+
+
+'''Extracts every file in paths on a pool of workers and writes the results as they come in, chunk_size rows
+   at a time. Results keep the order of paths. Returns {path: missing variables} for files with gaps.'''
+def extract_files(paths, template_list, output, output_format='csv', workers=None, chunk_size=100, pid=None, template_name=''):
+    gaps = {}
+    columns = output_columns(template_list)
+    started = time.perf_counter()
+    total_lines = 0
+
+    with open(output, 'w', newline='', encoding='utf-8') as output_file, \
+         ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(template_list, pid)) as executor:
+
+        if output_format == 'csv':
+            writer = csv.DictWriter(output_file, fieldnames=columns, extrasaction='ignore')
+            writer.writeheader()
+
+        chunk = []
+        for done, (path, params, missing, lines) in enumerate(executor.map(extract_file, paths, chunksize=max(1, chunk_size // 4)), 1):
+            row = dict.fromkeys(onboarding_columns, '')
+            row.update({'name': params.get('HOSTNAME') or '', 'pid': pid or '', 'template_name': template_name})
+            row.update(params)
+            row['config_file'] = path
+            chunk.append(row)
+            total_lines += lines
+            if missing:
+                gaps[path] = missing
+
+            if len(chunk) >= chunk_size or done == len(paths):
+                if output_format == 'csv':
+                    writer.writerows(chunk)
+                else:
+                    output_file.writelines(json.dumps(row) + "\n" for row in chunk)
+                output_file.flush()
+                chunk = []
+                elapsed = time.perf_counter() - started
+                print(f"{done}/{len(paths)} configs, {round(total_lines / elapsed)} lines/s", file=sys.stderr)
+
+    return gaps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract template values from a directory of saved running configs.")
+    parser.add_argument('config_dir', help="Directory of running config files")
+    parser.add_argument('template', help="Jinja onboarding template file, e.g. example_template.txt")
+    parser.add_argument('--output', default='config/offline_extract.csv', help="CSV or JSONL (.jsonl) output file")
+    parser.add_argument('--pattern', default='*', help="File name pattern within config_dir, e.g. '*.cfg'")
+    parser.add_argument('--pid', help="New switch pid, applies its interface translations to every config")
+    parser.add_argument('--workers', type=int, help="Worker processes, default one per CPU core")
+    parser.add_argument('--chunk-size', type=int, default=100, help="Rows written per chunk")
+    parser.add_argument('--gaps', help="Also write the per-file extraction gaps as CSV to this file")
+    args = parser.parse_args()
+
+    paths = sorted(path for path in glob.glob(os.path.join(args.config_dir, args.pattern)) if os.path.isfile(path))
+    if not paths:
+        raise SystemExit(f"No config files found in {args.config_dir}")
+    with open(args.template, 'r') as template_file:
+        template_list = config_transfer.template_text_to_list(template_file.read())
+
+    output_format = 'jsonl' if args.output.endswith('.jsonl') else 'csv'
+    gaps = extract_files(paths, template_list, args.output, output_format, args.workers, args.chunk_size,
+                         args.pid, os.path.basename(args.template))
+
+    print(f"Extracted {len(paths)} configs to {args.output}, {len(gaps)} with gaps.")
+    for path, missing in gaps.items():
+        print(f"  {path}: missing {', '.join(missing)}")
+    if args.gaps:
+        with open(args.gaps, 'w', newline='') as gaps_file:
+            writer = csv.writer(gaps_file)
+            writer.writerow(['config_file', 'missing_variables'])
+            writer.writerows([path, ' '.join(missing)] for path, missing in gaps.items())
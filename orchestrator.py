@@ -0,0 +1,67 @@
+""" Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+           https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+'''Splits the serials of the mapping file into waves, in mapping order. With by_site every site becomes
+   its own wave (or several, when wave_size is also given), otherwise waves are wave_size serials each.
+   Without either option the whole mapping file is a single wave.'''
+def split_waves(serials, site_names=None, wave_size=None, by_site=False):
+    groups = [list(serials)]
+    if by_site:
+        by_name = {}
+        for serial in serials:
+            by_name.setdefault(site_names[serial], []).append(serial)
+        groups = list(by_name.values())
+
+    if not wave_size:
+        return groups
+    return [group[i:i + wave_size] for group in groups for i in range(0, len(group), wave_size)]
+
+
+'''Runs the waves through the stages as a pipeline: every wave goes through the stages in order, but
+   while wave N is in a later stage (e.g. deleting) wave N+1 can already be in an earlier one (e.g.
+   fetching configs). stages is a list of (name, function(serials)), stage_limits maps a stage name to
+   how many waves may be in that stage at once (default 1), the API calls of all waves together stay within
+   the client's max_workers. When a stage fails, no wave starts
+   another stage and the first error is raised once the running stages have finished.
+   The wall time of every stage run is recorded in the metrics registry, labelled with cluster.'''
+def run_waves(waves, stages, stage_limits=None, cluster=None):
+    stage_limits = stage_limits or {}
+    slots = {name: threading.Semaphore(stage_limits.get(name, 1)) for name, _ in stages}
+    failed = threading.Event()
+
+    def run_wave(number, serials):
+        for name, stage in stages:
+            with slots[name]:
+                if failed.is_set():
+                    return
+                print(f"Wave {number}/{len(waves)} ({len(serials)} devices): {name}")
+                try:
+                    with metrics.registry.stage(name, items=len(serials), cluster=cluster):
+                        stage(serials)
+                except BaseException:
+                    failed.set()
+                    raise
+
+    #One wave per stage can be in flight, more would only wait for a stage slot
+    depth = max(1, sum(stage_limits.get(name, 1) for name, _ in stages))
+    with ThreadPoolExecutor(max_workers=min(depth, len(waves)) or 1) as executor:
+        futures = [executor.submit(run_wave, number, serials) for number, serials in enumerate(waves, 1)]
+        errors = [future.exception() for future in futures]
+
+    for error in errors:
+        if error is not None:
+            raise error
@@ -0,0 +1,144 @@
+""" Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+           https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import config_transfer
+
+#Page size of the site and image listings (DNAC caps limit at 500)
+site_page_limit = 500
+image_page_limit = 500
+
+#PnP states a new switch may already be in, it is reused by the import instead of added again
+reusable_pnp_states = ('Unclaimed',)
+
+'''Go/no-go report of a pre-flight check. problems are serial -> list of problems of that switch,
+   general_problems concern the whole run (e.g. the template), warnings don't stop the run.
+   cluster names the DNA Center cluster the switches are on.'''
+class PreflightReport:
+
+    def __init__(self, serials, cluster=None):
+        self.serials = serials
+        self.cluster = cluster
+        self.problems = {}
+        self.general_problems = []
+        self.warnings = {}
+
+    def add(self, serial, problem):
+        self.problems.setdefault(serial, []).append(problem)
+
+    def warn(self, serial, warning):
+        self.warnings.setdefault(serial, []).append(warning)
+
+    @property
+    def go(self):
+        return not self.problems and not self.general_problems
+
+    def to_dict(self):
+        return {'go': self.go, 'cluster': self.cluster, 'devices': len(self.serials), 'general_problems': self.general_problems,
+                'problems': self.problems, 'warnings': self.warnings}
+
+    def print_report(self):
+        cluster = f" on cluster {self.cluster}" if self.cluster else ""
+        print(f"Pre-flight check of {len(self.serials)} switches{cluster}: {'GO' if self.go else 'NO-GO'}")
+        for problem in self.general_problems:
+            print(f"  {problem}")
+        for serial in self.serials:
+            for problem in self.problems.get(serial, []):
+                print(f"  {serial}: {problem}")
+            for warning in self.warnings.get(serial, []):
+                print(f"  {serial}: warning, {warning}")
+        if self.problems:
+            print(f"{len(self.problems)} of {len(self.serials)} switches can not be migrated, nothing has been deleted.")
+
+
+#Every item of a listing, paged with offset/limit until a page comes back short
+def list_paged(client, path, limit):
+    items = []
+    offset = 1
+    while True:
+        page = client.get(path, params={'offset': offset, 'limit': limit}).json()['response']
+        items.extend(page)
+        if len(page) < limit:
+            return items
+        offset += limit
+
+#Every site of DNAC in one paged listing, siteNameHierarchy (the site_name of the mapping file) -> site id
+def list_sites(client):
+    return {site.get('siteNameHierarchy'): site['id'] for site in list_paged(client, "/site", site_page_limit)}
+
+#Every image of the image repository in one paged listing, image file name -> image uuid
+def list_images(client):
+    return {image.get('name'): image['imageUuid'] for image in list_paged(client, "/image/importation", image_page_limit)}
+
+
+'''Resolves every distinct site name and image of the mapping file with one listing each, names the
+   client's resolver cache already has are not looked up. Resolved ids are stored in the resolver
+   cache, so the image and claim stages don't look them up again. Returns (site ids, image ids).'''
+def resolve_names(client, site_names, image_names):
+    resolver = client.resolver
+    listings = {'site': (site_names, list_sites), 'image': (image_names, list_images)}
+
+    resolved = {}
+    for kind, (names, _) in listings.items():
+        values = {name: resolver.get(kind, name) if resolver else None for name in names}
+        resolved[kind] = {name: value for name, value in values.items() if value is not None}
+
+    incomplete = [kind for kind, (names, _) in listings.items() if len(resolved[kind]) < len(names)]
+    for kind, found in zip(incomplete, client.map_concurrent(lambda kind: listings[kind][1](client), incomplete)):
+        for name in listings[kind][0]:
+            if name not in resolved[kind] and name in found:
+                resolved[kind][name] = found[name]
+                if resolver:
+                    resolver.set(kind, name, found[name])
+    return resolved['site'], resolved['image']
+
+
+'''Checks the whole mapping file before anything is changed. devices are the old switches found in the
+   inventory (old serial -> device), pnp_devices the new serials already in PnP (new serial -> PnP device),
+   compiled_template the compiled onboarding template, template_problem why it could not be loaded (not
+   found, syntax error). skip_pnp holds old serials a resumed run has already imported. Returns a PreflightReport.'''
+def check_mapping(client, mapping, devices, pnp_devices, compiled_template, template_name, template_problem=None, skip_pnp=(),
+                  cluster=None):
+    report = PreflightReport(mapping.old_serials(), cluster)
+
+    if template_problem:
+        report.general_problems.append(template_problem)
+    else:
+        extracted = {'INTERFACE_CONFIG'}
+        for rule in config_transfer.EXTRACTION_RULES:
+            extracted.update(rule.variables)
+        not_extracted = [name for name in compiled_template.variables if name not in extracted]
+        if not_extracted:
+            report.general_problems.append(f"template {template_name} uses variables {not_extracted} that are not "
+                                           "extracted from the running configs, every switch would be rejected")
+
+    site_names = list(dict.fromkeys(row.site_name for row in mapping.rows))
+    image_names = list(dict.fromkeys(row.image_version for row in mapping.rows if row.image_version))
+    site_ids, image_ids = resolve_names(client, site_names, image_names)
+
+    for row in mapping.rows:
+        if row.old_serial not in devices:
+            report.add(row.old_serial, "old serial not found in the DNAC inventory")
+        if row.site_name not in site_ids:
+            report.add(row.old_serial, f"site {row.site_name} not found")
+        if row.image_version and row.image_version not in image_ids:
+            report.add(row.old_serial, f"image {row.image_version} not found in the image repository")
+
+        pnp_device = pnp_devices.get(row.new_serial)
+        if pnp_device and row.old_serial not in skip_pnp:
+            state = pnp_device.get('deviceInfo', {}).get('state')
+            if state in reusable_pnp_states:
+                report.warn(row.old_serial, f"new serial {row.new_serial} is already in PnP ({state}), it will be reused")
+            else:
+                report.add(row.old_serial, f"new serial {row.new_serial} is already in PnP in state {state}")
+
+    return report
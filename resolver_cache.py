@@ -0,0 +1,86 @@
+""" Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+           https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import json, os, threading, time
+
+'''Cache of name -> id lookups (site name -> site id, image file name -> image uuid).
+   Within a run every name is only looked up once, even when several threads ask for it at the
+   same time. Entries are persisted to a json file and reused by later runs until they are older
+   than ttl seconds, invalidate() drops entries explicitly, e.g. after a site was recreated.'''
+class ResolverCache:
+
+    def __init__(self, path, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        self.entries = None
+        self.lock = threading.Lock()
+        self.key_locks = {}
+
+    def load(self):
+        if self.entries is None:
+            try:
+                with open(self.path, 'r') as cache_file:
+                    self.entries = json.load(cache_file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self.entries = {}
+        return self.entries
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as cache_file:
+            json.dump(self.entries, cache_file, indent=2)
+        os.replace(temp_path, self.path)
+
+    def get(self, kind, name):
+        with self.lock:
+            entry = self.load().get(kind, {}).get(name)
+        if entry and time.time() - entry['time'] < self.ttl:
+            return entry['id']
+        return None
+
+    def set(self, kind, name, value):
+        with self.lock:
+            self.load().setdefault(kind, {})[name] = {'id': value, 'time': time.time()}
+            self.save()
+
+    #Returns the cached id, otherwise calls lookup(name) once and caches its result
+    def resolve(self, kind, name, lookup):
+        value = self.get(kind, name)
+        if value is not None:
+            return value
+
+        with self.lock:
+            key_lock = self.key_locks.setdefault((kind, name), threading.Lock())
+
+        #Threads asking for the same name wait for the first lookup instead of repeating it
+        with key_lock:
+            value = self.get(kind, name)
+            if value is None:
+                value = lookup(name)
+                self.set(kind, name, value)
+        return value
+
+    #Drops one entry, every entry of a kind, or the whole cache when called without arguments
+    def invalidate(self, kind=None, name=None):
+        with self.lock:
+            entries = self.load()
+            if kind is None:
+                entries.clear()
+            elif name is None:
+                entries.pop(kind, None)
+            else:
+                entries.get(kind, {}).pop(name, None)
+            self.save()
@@ -0,0 +1,96 @@
+""" Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+           https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import json, os, threading, time
+
+'''Append-only JSONL journal of a migration run. Every line records that one device (keyed by the
+   old switch serial of the mapping file) completed one stage, together with the data that stage
+   produced, e.g. {"time": ..., "serial": "FOC123", "stage": "delete", "data": {...}}.
+   Reopening the journal of an interrupted run replays it, so each device resumes after its
+   last completed stage. Records are flushed and synced before the next step runs, a device
+   recorded as deleted is never deleted twice. The latest record of a (serial, stage) wins.
+   Large stages (running configs, extracted values) are not held in memory, only their offset in the file.'''
+class RunJournal:
+
+    large_stages = ('config', 'params')
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self.offsets = {}
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(path):
+            self.load()
+        self.file = open(path, 'ab')
+
+    def load(self):
+        with open(self.path, 'rb') as journal_file:
+            offset = 0
+            for line in journal_file:
+                if not line.endswith(b'\n'):
+                    #The last line, cut short by a crash, that stage simply runs again
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    #A damaged line, that stage simply runs again
+                    offset += len(line)
+                    continue
+                self.remember(record, offset)
+                offset += len(line)
+
+        #The cut short line is dropped, otherwise the next record would be appended onto it and both would be lost
+        if offset < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as journal_file:
+                journal_file.truncate(offset)
+                os.fsync(journal_file.fileno())
+
+    def remember(self, record, offset):
+        key = (record['serial'], record['stage'])
+        if record['stage'] in self.large_stages:
+            self.offsets[key] = offset
+        else:
+            self.records[key] = record['data']
+
+    def record(self, serial, stage, data):
+        line = (json.dumps({'time': time.time(), 'serial': serial, 'stage': stage, 'data': data}) + '\n').encode()
+        with self.lock:
+            offset = self.file.tell()
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.remember({'serial': serial, 'stage': stage, 'data': data}, offset)
+
+    def done(self, serial, stage):
+        return (serial, stage) in self.records or (serial, stage) in self.offsets
+
+    def get(self, serial, stage, default=None):
+        key = (serial, stage)
+        if key in self.offsets:
+            with open(self.path, 'rb') as journal_file:
+                journal_file.seek(self.offsets[key])
+                return json.loads(journal_file.readline())['data']
+        return self.records.get(key, default)
+
+    #The serials that still have to go through a stage, in the given order. ok can check the recorded
+    #data, e.g. a failed claim is recorded but the device still has to be claimed again
+    def pending(self, serials, stage, ok=None):
+        return [serial for serial in serials
+                if not self.done(serial, stage) or (ok is not None and not ok(self.get(serial, stage)))]
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,76 @@
+""" Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+           https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import hashlib, threading
+from collections import namedtuple
+from jinja2 import Environment, StrictUndefined, TemplateError, UndefinedError, meta
+
+'''An onboarding template compiled once. variables are the names the template needs from the claim parameters,
+   taken from the parsed template: variables only used inside {% for %} or {% if %} blocks are included,
+   loop variables and variables set within the template are not.'''
+CompiledTemplate = namedtuple('CompiledTemplate', ['key', 'template', 'variables', 'source'])
+
+#Rendered day-0 configs larger than this many bytes are rejected before claiming
+max_render_bytes = 256 * 1024
+#StrictUndefined makes any variable missing from the parameters a render error instead of an empty string
+environment = Environment(undefined=StrictUndefined, keep_trailing_newline=True)
+compiled_templates = {}
+compile_lock = threading.Lock()
+
+#DNAC templates are cached by id and version, templates without an id (e.g. read from a file) by content
+def template_key(template_text, template_id=None, version=None):
+    if template_id:
+        return (template_id, version)
+    return ('sha256', hashlib.sha256(template_text.encode()).hexdigest())
+
+'''Parses and compiles template_text once per template id and version. A template edited in DNAC
+   without committing a new version keeps its version, so the source is compared as well.
+   Raises jinja2.TemplateSyntaxError for templates that can not be parsed.'''
+def compile_template(template_text, template_id=None, version=None):
+    key = template_key(template_text, template_id, version)
+    with compile_lock:
+        compiled = compiled_templates.get(key)
+        if compiled is None or compiled.source != template_text:
+            parsed = environment.parse(template_text)
+            compiled = CompiledTemplate(key, environment.from_string(parsed), sorted(meta.find_undeclared_variables(parsed)),
+                                        template_text)
+            compiled_templates[key] = compiled
+    return compiled
+
+
+'''Renders the template with one device's parameters. A variable the parameters don't have, or have as
+   None, would be rendered into the device config as "None" or fail the PnP provisioning, so both count
+   as undefined. Returns {'ok', 'bytes', 'problems'}.'''
+def check_render(compiled, params, max_bytes=max_render_bytes):
+    undefined = [name for name in compiled.variables if params.get(name) is None]
+    if undefined:
+        return {'ok': False, 'bytes': 0, 'problems': [f"undefined variables {undefined}"]}
+
+    try:
+        rendered = compiled.template.render(params)
+    except UndefinedError as e:
+        return {'ok': False, 'bytes': 0, 'problems': [f"undefined variable: {e.message}"]}
+    except TemplateError as e:
+        return {'ok': False, 'bytes': 0, 'problems': [f"render failed: {e}"]}
+
+    size = len(rendered.encode())
+    if size > max_bytes:
+        return {'ok': False, 'bytes': size, 'problems': [f"rendered config is {size} bytes, limit is {max_bytes}"]}
+    return {'ok': True, 'bytes': size, 'problems': []}
+
+
+'''Renders every device's parameters locally and returns the check_render result of each, in order.
+   params_list can be any iterable, e.g. parameters read from the journal one device at a time. Rendering
+   runs in this process, a device renders in microseconds, far less than starting a worker process would cost.'''
+def check_renders(compiled, params_list, max_bytes=max_render_bytes):
+    return [check_render(compiled, params, max_bytes) for params in params_list]